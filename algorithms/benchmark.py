@@ -0,0 +1,347 @@
+"""
+Benchmark suite for the recommender across catalog sizes.
+
+Synthetic catalogs are shaped like recipe_ingredient_matrix_VF.csv: the same
+ingredient columns (extended with synthetic ones if more are asked for),
+about as many ingredients per recipe, and a Zipf-skewed ingredient
+popularity, so a few staples appear in most recipes and most ingredients
+in few. Pantries are drawn from the same popularity.
+
+For every catalog size and mode the suite reports p50/p95/p99 latency,
+throughput and the peak RSS reached while the mode ran, and stores the run
+as JSON (with interpreter, library and machine details) so runs can be
+compared over time.
+
+Usage:
+    python benchmark.py [--sizes 1000 10000 ...] [--modes weighted ...]
+                        [--queries 200] [--output results.json]
+    python benchmark.py --compare old.json new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+import scipy
+from scipy import sparse
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# The ranking modes time recommend(), "approx_jaccard" the MinHash/LSH one;
+# "scan" times the weighted ranking as a full scan (ScoringEngine.score +
+# argpartition), the baseline of the inverted index behind "weighted";
+# "batch" times recommend_batch, and "sharded" a ShardedScorer over one
+# process per CPU, both with latency per single-query call and throughput of
+# all queries as one batch ("batch" also reports its speedup over a loop of
+# recommend calls). Peak RSS does not include the shard workers
+BENCHMARK_MODES = ("weighted", "scan", "coverage", "jaccard", "approx_jaccard", "batch",
+                   "sharded")
+
+# Mean ingredients per recipe of the bundled matrix
+MEAN_RECIPE_SIZE = 8.8
+ZIPF_SKEW = 1.0
+
+# Recipes generated at a time, to bound the memory of catalog generation
+GENERATE_CHUNK_ROWS = 1_000_000
+
+
+def ingredient_columns(num_ingredients=None):
+    """
+    The ingredient columns of the bundled matrix, extended with synthetic
+    "ingredient_<i>" columns up to num_ingredients.
+    """
+    from recommender_index import DEFAULT_MATRIX_PATH
+
+    try:
+        with open(DEFAULT_MATRIX_PATH, encoding="utf-8") as f:
+            columns = f.readline().rstrip("\n").split(",")[1:]
+    except OSError:
+        columns = []
+    if num_ingredients is None:
+        num_ingredients = len(columns) or 100
+    synthetic = [f"ingredient_{i}" for i in range(len(columns), num_ingredients)]
+    return (columns + synthetic)[:num_ingredients]
+
+
+def popularity(num_ingredients, skew=ZIPF_SKEW):
+    """
+    Zipf probabilities of drawing each ingredient column.
+    """
+    weights = 1.0 / np.arange(1, num_ingredients + 1) ** skew
+    return weights / weights.sum()
+
+
+def synthetic_catalog(num_recipes, num_ingredients=None, mean_size=MEAN_RECIPE_SIZE,
+                      skew=ZIPF_SKEW, seed=0):
+    """
+    Returns a sparse ScoringEngine over num_recipes synthetic recipes.
+    Recipe sizes are Poisson(mean_size) (at least 1); ingredients are drawn
+    by Zipf popularity, shuffled over the columns so popular ingredients are
+    not all in the first columns.
+    """
+    from ingredient_weights import INGREDIENT_WEIGHTS
+    from scoring_engine import ScoringEngine
+
+    rng = np.random.default_rng(seed)
+    ingredients = ingredient_columns(num_ingredients)
+    probabilities = rng.permutation(popularity(len(ingredients), skew))
+
+    blocks = []
+    for start in range(0, num_recipes, GENERATE_CHUNK_ROWS):
+        rows = min(GENERATE_CHUNK_ROWS, num_recipes - start)
+        sizes = np.maximum(rng.poisson(mean_size, size=rows), 1)
+        cols = rng.choice(len(ingredients), size=int(sizes.sum()), p=probabilities)
+        block = sparse.csr_matrix(
+            (np.ones(len(cols), dtype=np.uint8), (np.repeat(np.arange(rows), sizes), cols)),
+            shape=(rows, len(ingredients)),
+        )
+        block.sum_duplicates()
+        block.data[:] = 1
+        blocks.append(block)
+
+    matrix = sparse.vstack(blocks, format="csr")
+    return ScoringEngine(_recipe_names(num_recipes), ingredients, matrix,
+                         INGREDIENT_WEIGHTS, "sparse")
+
+
+def _recipe_names(num_recipes):
+    # "recipe_<row>" titles as a StringTable, encoded chunk by chunk so that
+    # millions of titles never exist as Python strings at once
+    from string_table import StringTable
+
+    blobs, offsets, end = [], [np.zeros(1, dtype=np.int64)], 0
+    for start in range(0, num_recipes, GENERATE_CHUNK_ROWS):
+        stop = min(start + GENERATE_CHUNK_ROWS, num_recipes)
+        table = StringTable.from_strings(f"recipe_{row}" for row in range(start, stop))
+        blobs.append(table.blob)
+        offsets.append(table.offsets[1:] + end)
+        end += int(table.offsets[-1])
+    blob = np.concatenate(blobs) if blobs else np.zeros(0, dtype=np.uint8)
+    return StringTable(blob, np.concatenate(offsets))
+
+
+def synthetic_pantries(engine, num_queries, min_size=3, max_size=10, seed=1):
+    """
+    Ingredient lists of random sizes, drawn by column popularity in engine.
+    """
+    rng = np.random.default_rng(seed)
+    counts = np.bincount(engine.matrix.indices, minlength=len(engine.ingredients))
+    probabilities = (counts + 1) / (counts + 1).sum()
+    pantries = []
+    for size in rng.integers(min_size, max_size + 1, size=num_queries):
+        size = min(int(size), len(engine.ingredients))
+        cols = rng.choice(len(engine.ingredients), size=size, replace=False, p=probabilities)
+        pantries.append([engine.ingredients[col] for col in cols])
+    return pantries
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS of this process (Linux); returns False if unsupported.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux, bytes on macOS; it cannot be reset
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+def run_mode(index, mode, pantries, k=10, time_budget=30.0, min_queries=5):
+    """
+    Times one recommendation per pantry (or until time_budget seconds have
+    passed, after at least min_queries). Returns a result dict.
+    """
+    from scoring_engine import top_k_rows
+
+    engine = index.engine
+    if mode in ("coverage", "jaccard"):
+        # Build the recipe sizes (and the packed sets) outside the timed queries
+        engine.recipe_sizes
+        if mode == "jaccard":
+            engine.packed
+    if mode == "weighted":
+        index.inverted_index
+    if mode == "approx_jaccard":
+        # Builds the packed sets and the LSH tables
+        index.recommend(pantries[0], k, mode)
+    scorer = None
+    if mode == "sharded":
+        from sharded_scoring import ShardedScorer
+        scorer = ShardedScorer(engine)
+        # Starts the workers, which map the shared block
+        scorer.recommend(pantries[0], k)
+
+    try:
+        reset_peak_rss()
+        latencies = []
+        start = time.perf_counter()
+        for pantry in pantries:
+            began = time.perf_counter()
+            if mode == "batch":
+                index.recommend_batch([pantry], k)
+            elif mode == "sharded":
+                scorer.recommend(pantry, k)
+            elif mode == "scan":
+                top_k_rows(engine.score(pantry)[None], k)
+            else:
+                index.recommend(pantry, k, mode)
+            latencies.append(time.perf_counter() - began)
+            if len(latencies) >= min_queries and time.perf_counter() - start > time_budget:
+                break
+        elapsed = time.perf_counter() - start
+
+        if mode in ("batch", "sharded"):
+            # Throughput of the whole query set as a single batch
+            recommend_batch = scorer.recommend_batch if scorer else index.recommend_batch
+            began = time.perf_counter()
+            recommend_batch(pantries[:len(latencies)], k)
+            elapsed = time.perf_counter() - began
+        if mode == "batch":
+            # The loop of single recommend() calls that a batch replaces
+            began = time.perf_counter()
+            for pantry in pantries[:len(latencies)]:
+                index.recommend(pantry, k)
+            loop_elapsed = time.perf_counter() - began
+    finally:
+        if scorer is not None:
+            scorer.close()
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    extra = {"speedup_vs_loop": loop_elapsed / elapsed} if mode == "batch" else {}
+    return {
+        **extra,
+        "mode": mode,
+        "queries": len(latencies),
+        "k": k,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "throughput_qps": len(latencies) / elapsed if elapsed else float("inf"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, modes=BENCHMARK_MODES, num_queries=200, k=10,
+                  num_ingredients=None, skew=ZIPF_SKEW, time_budget=30.0, log=print):
+    """
+    Benchmarks every mode on a synthetic catalog of every size.
+    Returns the run as a JSON-serializable dict.
+    """
+    from recommender_index import RecommenderIndex
+
+    results = []
+    for size in sizes:
+        reset_peak_rss()
+        began = time.perf_counter()
+        engine = synthetic_catalog(size, num_ingredients, skew=skew)
+        build_s = time.perf_counter() - began
+        catalog = {
+            "recipes": size,
+            "ingredients": len(engine.ingredients),
+            "nnz": int(engine.matrix.nnz),
+            "build_s": build_s,
+            "build_peak_rss_mb": peak_rss_mb(),
+        }
+
+        index = RecommenderIndex.from_engine(engine, cache_size=0, merge_threshold=None)
+        pantries = synthetic_pantries(engine, num_queries)
+        for mode in modes:
+            result = dict(catalog, **run_mode(index, mode, pantries, k, time_budget))
+            log(f"{size:>10} recipes  {mode:<14} p50 {result['p50_ms']:9.3f} ms  "
+                f"p99 {result['p99_ms']:9.3f} ms  {result['throughput_qps']:10.1f} q/s  "
+                f"peak {result['peak_rss_mb']:8.1f} MB"
+                + (f"  x{result['speedup_vs_loop']:.2f} vs loop"
+                   if "speedup_vs_loop" in result else ""))
+            results.append(result)
+        del index, engine
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "settings": {"queries": num_queries, "k": k, "skew": skew,
+                     "mean_recipe_size": MEAN_RECIPE_SIZE, "time_budget_s": time_budget},
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """
+    Rows of (recipes, mode, metric, old, new, new / old) for the results the
+    two runs have in common.
+    """
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_qps", "peak_rss_mb")
+    previous = {(r["recipes"], r["mode"]): r for r in old["results"]}
+    rows = []
+    for result in new["results"]:
+        before = previous.get((result["recipes"], result["mode"]))
+        if before is None:
+            continue
+        for metric in metrics:
+            ratio = result[metric] / before[metric] if before[metric] else float("inf")
+            rows.append((result["recipes"], result["mode"], metric, before[metric],
+                         result[metric], ratio))
+    return rows
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+    parser = argparse.ArgumentParser(description="Benchmark the recommender.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--modes", nargs="+", choices=BENCHMARK_MODES, default=BENCHMARK_MODES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ingredients", type=int, default=None,
+                        help="ingredient columns (default: those of the bundled matrix)")
+    parser.add_argument("--skew", type=float, default=ZIPF_SKEW)
+    parser.add_argument("--time-budget", type=float, default=30.0,
+                        help="seconds per size and mode before stopping early")
+    parser.add_argument("--output", default=None, help="JSON file to write the run to")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two saved runs instead of benchmarking")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        for recipes, mode, metric, before, after, ratio in compare(old, new):
+            print(f"{recipes:>10} {mode:<14} {metric:<15} {before:12.3f} -> {after:12.3f}"
+                  f"  x{ratio:.2f}")
+        sys.exit(0)
+
+    run = run_benchmark(args.sizes, args.modes, args.queries, args.k, args.ingredients,
+                        args.skew, args.time_budget)
+    output = args.output or f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"Results saved to {output}")
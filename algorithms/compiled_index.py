@@ -0,0 +1,182 @@
+"""
+Compiled binary recipe index.
+
+An offline compile step turns the recipe x ingredient CSV and the ingredient
+taxonomy (ing_map.ingredients, through INGREDIENT_WEIGHTS) into a single
+versioned file that workers open zero-copy with numpy.memmap. Start time then
+does not grow with the catalog, and forked workers share the same page cache,
+including the posting lists (the matrix in CSC order) of the inverted index.
+
+Layout:
+    MAGIC (8 bytes) | header length (uint32) | JSON header | padding | sections
+Every section is a raw little-endian array starting on a SECTION_ALIGN byte
+boundary; the header records its offset, dtype and shape.
+
+Usage:
+    python compiled_index.py [matrix.csv] [output.rrx]
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+
+from scoring_engine import ScoringEngine
+from string_table import StringTable
+
+MAGIC = b"RRIDX\x00\x00\x00"
+# 2: adds the recipe_ids section
+# 3: adds the posting_indptr and posting_indices (CSC) sections
+FORMAT_VERSION = 3
+SECTION_ALIGN = 64
+
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(__file__), '..', 'datasets',
+                                  'recipe_index.rrx')
+
+
+def is_compiled_index(path):
+    """
+    True if path starts with the compiled index magic bytes.
+    """
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _index_dtype(matrix):
+    # scipy keeps caller arrays only when indices and indptr share a dtype
+    # it would have picked itself
+    if max(matrix.nnz, *matrix.shape) < np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
+
+
+def write_index(engine, output_path):
+    """
+    Writes a ScoringEngine to output_path in the compiled index format.
+    """
+    matrix = sparse.csr_matrix(engine.matrix, dtype=np.uint8)
+    matrix.sort_indices()
+    index_dtype = _index_dtype(matrix)
+    names = engine.recipe_names
+    if not isinstance(names, StringTable):
+        names = StringTable.from_strings(names)
+    posting_indptr, posting_indices = engine.postings
+
+    arrays = {
+        "weights": engine.weights.astype("<i8"),
+        "recipe_ids": engine.recipe_ids.astype("<i8"),
+        "indptr": matrix.indptr.astype(index_dtype),
+        "indices": matrix.indices.astype(index_dtype),
+        "data": matrix.data.astype(np.uint8),
+        "posting_indptr": posting_indptr.astype(index_dtype),
+        "posting_indices": posting_indices.astype(index_dtype),
+        "name_offsets": names.offsets.astype("<i8"),
+        "name_blob": names.blob,
+    }
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "num_recipes": matrix.shape[0],
+        "ingredients": [str(ingr) for ingr in engine.ingredients],
+        "sections": {},
+    }
+
+    # Section offsets depend on the header size, which depends on the
+    # offsets; iterate until the header length is stable
+    header_bytes = b""
+    while True:
+        offset = _align(len(MAGIC) + 4 + len(header_bytes))
+        for name, array in arrays.items():
+            header["sections"][name] = {
+                "offset": offset,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+            }
+            offset = _align(offset + array.nbytes)
+        encoded = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(encoded) == len(header_bytes):
+            break
+        header_bytes = encoded
+
+    with open(output_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b"\x00" * (header["sections"][name]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    return output_path
+
+
+def compile_index(csv_path, output_path, ingredient_weights=None):
+    """
+    Compiles a recipe x ingredient CSV into a binary index at output_path.
+    """
+    if ingredient_weights is None:
+        from ingredient_weights import INGREDIENT_WEIGHTS
+        ingredient_weights = INGREDIENT_WEIGHTS
+
+    engine = ScoringEngine.from_csv(csv_path, ingredient_weights, backend="sparse")
+    return write_index(engine, output_path)
+
+
+def open_index(path, ingredient_weights=None):
+    """
+    Opens a compiled index as a sparse ScoringEngine whose matrix, weights and
+    recipe names are read-only views into a numpy.memmap of the file.
+    ingredient_weights, when given, replaces the compiled weight vector.
+    """
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(mapped[:len(MAGIC)]) != MAGIC:
+        raise ValueError(f"'{path}' is not a compiled recipe index")
+
+    header_length = int(mapped[len(MAGIC):len(MAGIC) + 4].view("<u4")[0])
+    header_start = len(MAGIC) + 4
+    header = json.loads(bytes(mapped[header_start:header_start + header_length]))
+    if header["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"'{path}' has index format version {header['format_version']}, "
+            f"expected {FORMAT_VERSION}"
+        )
+
+    sections = {}
+    for name, section in header["sections"].items():
+        dtype = np.dtype(section["dtype"])
+        count = int(np.prod(section["shape"]))
+        start = section["offset"]
+        sections[name] = mapped[start:start + count * dtype.itemsize].view(dtype)
+
+    ingredients = header["ingredients"]
+    matrix = sparse.csr_matrix(
+        (sections["data"], sections["indices"], sections["indptr"]),
+        shape=(header["num_recipes"], len(ingredients)),
+    )
+    names = StringTable(sections["name_blob"], sections["name_offsets"])
+    if ingredient_weights is None:
+        ingredient_weights = dict(zip(ingredients, sections["weights"].tolist()))
+
+    # Workers share the posting lists of the inverted index through the page
+    # cache instead of each building a CSC copy
+    return ScoringEngine(names, ingredients, matrix, ingredient_weights, backend="sparse",
+                         recipe_ids=sections["recipe_ids"],
+                         postings=(sections["posting_indptr"], sections["posting_indices"]))
+
+
+def _align(offset):
+    return -(-offset // SECTION_ALIGN) * SECTION_ALIGN
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from recommender_index import DEFAULT_MATRIX_PATH
+
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MATRIX_PATH
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_INDEX_PATH
+    compile_index(csv_path, output_path)
+    print(f"Compiled index saved to {output_path}")
@@ -0,0 +1,58 @@
+"""
+Diversity-aware re-ranking by maximal marginal relevance (MMR).
+
+The best few hundred candidates of a query are re-ranked greedily: each
+pick maximizes
+
+    (1 - diversity) * relevance - diversity * max similarity to the picks so far
+
+with relevance scaled to [0, 1] by the best candidate. Similarity is the
+weighted Jaccard similarity of similar_recipes.py, computed from one dense
+candidates x ingredients block. Only the similarities to the picked recipes
+are ever needed, so each pick costs one matrix-vector product over the
+block instead of filling the whole candidates x candidates matrix; re-ranking
+a few hundred candidates stays well under a millisecond.
+"""
+
+import numpy as np
+
+# Candidates re-ranked per query (at least the number of recipes asked for)
+DIVERSITY_CANDIDATES = 300
+
+
+def _similarity_to(block, weighted, totals, row):
+    # Weighted Jaccard similarity of candidate row to every candidate
+    shared = block @ weighted[row]
+    union = totals + totals[row] - shared
+    return np.divide(shared, union, out=np.zeros_like(shared), where=union > 0)
+
+
+def mmr_order(relevance, block, weights, k, diversity):
+    """
+    Returns the indices of the k candidates picked by MMR, in pick order.
+    relevance holds one score per candidate and block their ingredient rows.
+    diversity is in [0, 1]: 0 keeps the relevance order, higher values
+    trade relevance for dissimilarity to the recipes already picked.
+    Ties go to the earlier candidate.
+    """
+    if not 0 <= diversity <= 1:
+        raise ValueError(f"diversity must be between 0 and 1, got {diversity}")
+    relevance = np.asarray(relevance, dtype=np.float64)
+    k = min(max(int(k), 0), len(relevance))
+
+    top = relevance.max(initial=0.0)
+    gain = (1 - diversity) * (relevance / top if top > 0 else relevance)
+    weighted = block * weights
+    totals = weighted.sum(axis=1)
+    max_similarity = np.zeros(len(relevance))
+    available = np.ones(len(relevance), dtype=bool)
+
+    picks = []
+    for _ in range(k):
+        marginal = np.where(available, gain - diversity * max_similarity, -np.inf)
+        pick = int(np.argmax(marginal))
+        picks.append(pick)
+        available[pick] = False
+        np.maximum(max_similarity, _similarity_to(block, weighted, totals, pick),
+                   out=max_similarity)
+    return np.array(picks, dtype=np.intp)
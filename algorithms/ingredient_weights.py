@@ -28,4 +28,18 @@ def create_ingredient_weights():
     return ingredient_weight_map
 
 
+def create_ingredient_categories():
+    """
+    Maps each ingredient to the category its INGREDIENT_WEIGHTS weight comes from.
+    """
+    ingredient_category_map = {}
+
+    for category in category_weights:
+        if category in ingredients:
+            for standard_name in ingredients[category]:
+                ingredient_category_map[standard_name] = category
+    return ingredient_category_map
+
+
 INGREDIENT_WEIGHTS = create_ingredient_weights()
+INGREDIENT_CATEGORIES = create_ingredient_categories()
@@ -0,0 +1,216 @@
+import numpy as np
+
+from metrics import METRICS
+from scoring_engine import top_k_rows
+
+# Posting-list total, as a fraction of the matrix non-zeros, above which a
+# query is scored by a full scan instead of through the posting lists
+SCAN_FRACTION = 0.5
+
+# Matrices with fewer non-zeros are always scanned: the per-term overhead of
+# the posting lists outweighs scoring the whole matrix
+SCAN_MAX_NNZ = 200_000
+
+# Visited posting lists adding up to more than 1 / DENSE_MERGE_RATIO of the
+# recipes are summed in a bincount over the rows, cheaper than sorting them;
+# below, the work never depends on the catalog size
+DENSE_MERGE_RATIO = 2
+
+# A posting list is binary-searched for the candidates when it is more than
+# this many times longer than the candidate list, else added in full
+PROBE_RATIO = 8
+
+
+class InvertedIndex:
+    """
+    Inverted index over a ScoringEngine matrix.
+    Each ingredient column maps to its posting list: the sorted row ids of
+    the recipes that contain it. Top-k retrieval walks only the posting lists
+    of the query ingredients and uses MaxScore pruning, so the scoring work
+    depends on posting-list length rather than on the number of ingredients
+    of every recipe.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.num_recipes = len(engine.recipe_names)
+
+        # Shared with the engine, memory-mapped for a compiled index
+        self.indptr, self.indices = engine.postings
+
+    def posting_list(self, col):
+        """
+        Returns the sorted row ids of the recipes containing ingredient column col.
+        """
+        return self.indices[self.indptr[col]:self.indptr[col + 1]]
+
+    def top_k(self, ingredients_available, k, confidences=None, weight_overrides=None,
+              allowed=None):
+        """
+        Returns (rows, scores) of the k best recipes, best first, with ties
+        in row order -- the same ranking as a full scan.
+
+        Query terms are visited by decreasing upper bound (ingredient weight
+        times multiplicity), their weights summed per recipe over the union
+        of the visited posting lists. Once k candidates are known, any
+        recipe that is not yet a candidate can score at most the sum of the
+        remaining upper bounds;
+        when that is below the current k-th best partial score, the
+        remaining posting lists are only probed for the existing candidates,
+        and candidates that can no longer reach the threshold are dropped.
+        Queries whose posting lists add up to more than SCAN_FRACTION of the
+        matrix non-zeros (typically pantries of staples), and all queries on
+        matrices smaller than SCAN_MAX_NNZ, are scored by a full scan instead,
+        which is then cheaper.
+        See ScoringEngine.query_columns for confidences and weight_overrides.
+        With allowed (a boolean array over the rows, see recipe_filters.py),
+        posting lists are cut down to the allowed recipes before anything is
+        scored, and only allowed recipes are returned.
+        """
+        num_allowed = self.num_recipes if allowed is None else int(np.count_nonzero(allowed))
+        k = min(max(int(k), 0), num_allowed)
+        cols, upper_bounds = self.engine.query_columns(ingredients_available, confidences,
+                                                       weight_overrides)
+
+        # Weights must be positive for the upper bounds to be valid
+        keep = upper_bounds > 0
+        cols, upper_bounds = cols[keep], upper_bounds[keep]
+        postings = (self.indptr[cols + 1] - self.indptr[cols]).sum()
+        if len(self.indices) < SCAN_MAX_NNZ or postings > SCAN_FRACTION * len(self.indices):
+            return self._scan_top_k(cols, upper_bounds, k, allowed)
+
+        order = np.argsort(-upper_bounds, kind="stable")
+        cols, upper_bounds = cols[order], upper_bounds[order]
+        remaining = np.append(np.cumsum(upper_bounds[::-1])[::-1], 0)
+
+        # Candidates (sorted rows) and their partial scores; nothing is sized
+        # by the catalog, so the work depends on the visited posting lists only
+        candidates = np.empty(0, dtype=self.indices.dtype)
+        partial = np.empty(0, dtype=upper_bounds.dtype)
+        pending = []
+        term = 0
+
+        # Union phase: every recipe in these posting lists may still enter the top-k
+        while term < len(cols) and k > 0:
+            # The k-th best partial score is at most the bounds visited so far,
+            # so it is only worth computing once that exceeds the remaining ones.
+            # With fewer than k candidates it is -inf, which never stops the union.
+            if remaining[term] < remaining[0] - remaining[term]:
+                candidates, partial = _merge_postings(candidates, partial, pending,
+                                                      self.num_recipes)
+                pending = []
+                if remaining[term] < _kth_largest(partial, k):
+                    break
+            posting = self.posting_list(cols[term])
+            if allowed is not None:
+                posting = posting[allowed[posting]]
+            pending.append((posting, upper_bounds[term]))
+            term += 1
+        candidates, partial = _merge_postings(candidates, partial, pending, self.num_recipes)
+        METRICS.inc("candidates_scored_total", len(candidates), path="inverted_index")
+
+        # Probe phase: only existing candidates can still make the top-k
+        while term < len(cols) and len(candidates):
+            keep = partial + remaining[term] >= _kth_largest(partial, k)
+            candidates, partial = candidates[keep], partial[keep]
+
+            posting = self.posting_list(cols[term])
+            if len(candidates) * PROBE_RATIO < len(posting):
+                # Binary search of the few candidates in a long posting list
+                pos = np.searchsorted(posting, candidates)
+                hit = pos < len(posting)
+                hit[hit] = posting[pos[hit]] == candidates[hit]
+                partial[hit] += upper_bounds[term]
+            else:
+                # Binary search of the posting list entries among the candidates
+                pos = np.searchsorted(candidates, posting)
+                hit = pos < len(candidates)
+                hit[hit] = candidates[pos[hit]] == posting[hit]
+                partial[pos[hit]] += upper_bounds[term]
+            term += 1
+
+        rows, scores = _best_rows(candidates, partial, k)
+
+        if len(rows) < k:
+            # Fewer than k recipes match: fill up with zero-score recipes in row order
+            need = k - len(rows)
+            pool = (np.arange(need + len(candidates)) if allowed is None
+                    else np.flatnonzero(allowed)[:need + len(candidates)])
+            padding = np.setdiff1d(pool, candidates)[:need]
+            rows = np.concatenate([rows, padding.astype(rows.dtype)])
+            scores = np.concatenate([scores, np.zeros(need, dtype=scores.dtype)])
+
+        return rows, scores
+
+    def _scan_top_k(self, cols, query_weights, k, allowed):
+        # Full scan of the allowed rows only
+        rows = None if allowed is None else np.flatnonzero(allowed)
+        scores = self.engine.score_columns(cols, query_weights, rows)
+        top = top_k_rows(scores[None], k)[0]
+        METRICS.inc("candidates_scored_total", len(scores), path="scan")
+        return (top if rows is None else rows[top]), scores[top]
+
+    def recommend(self, ingredients_available, num_recipes, confidences=None,
+                  weight_overrides=None):
+        """
+        Returns the num_recipes best (recipe_name, score) pairs, best first.
+        """
+        rows, scores = self.top_k(ingredients_available, num_recipes, confidences,
+                                  weight_overrides)
+        names = self.engine.recipe_names
+        return [(names[row], score.item()) for row, score in zip(rows, scores)]
+
+
+def _best_rows(rows, scores, k):
+    """
+    The k best (rows, scores), best first, with ties in row order; rows
+    must be sorted.
+    """
+    threshold = _kth_largest(scores, k)
+    if threshold == -np.inf:
+        best = np.arange(len(scores))
+    else:
+        # Every row above the threshold, then the lowest tied rows
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+        best = np.concatenate([above, tied])
+    best = best[np.argsort(-scores[best], kind="stable")][:k]
+    return rows[best], scores[best]
+
+
+def _merge_postings(rows, scores, postings, num_rows):
+    """
+    Adds (posting, weight) pairs to the partial scores of the sorted rows;
+    returns the sorted union of the rows and their new scores.
+    """
+    if not any(len(posting) for posting, _ in postings):
+        return rows, scores
+    all_rows = np.concatenate([rows] + [posting for posting, _ in postings])
+    weights = np.concatenate([scores] + [np.full(len(posting), weight, dtype=scores.dtype)
+                                         for posting, weight in postings])
+    if len(all_rows) * DENSE_MERGE_RATIO > num_rows:
+        # Weights are positive, so every visited row has a non-zero total;
+        # bincount sums in float64, exact for the integer scores of a query
+        totals = np.bincount(all_rows, weights)
+        union = np.flatnonzero(totals)
+        return union.astype(rows.dtype), totals[union].astype(scores.dtype)
+
+    # A stable sort merges the already sorted runs (timsort)
+    order = np.argsort(all_rows, kind="stable")
+    all_rows = all_rows[order]
+    starts = np.flatnonzero(np.concatenate([[True], all_rows[1:] != all_rows[:-1]]))
+    return all_rows[starts], np.add.reduceat(weights[order], starts)
+
+
+def _kth_largest(values, k):
+    """
+    k-th largest entry of values, or -inf when there are fewer than k.
+    """
+    if len(values) < k or k == 0:
+        return -np.inf
+    # The smallest of k block maxima is a lower bound of the k-th largest;
+    # sorting the entries above it avoids np.partition, which degrades badly
+    # on the many tied scores of a query
+    bound = values[:len(values) // k * k].reshape(k, -1).max(axis=1).min()
+    top = np.sort(np.compress(values >= bound, values))
+    return top[len(top) - k]
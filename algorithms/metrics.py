@@ -0,0 +1,177 @@
+"""
+Stage timers, histograms and counters for the recommendation path.
+
+Instrumentation is off by default and then costs one attribute check per
+call: stage() hands back a shared no-op context manager and inc() returns
+immediately. Enable it with METRICS.enable() (or RECOMMENDER_METRICS=1 in
+the environment), then read it as a JSON-ready snapshot() or as Prometheus
+text exposition (prometheus_text()).
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+NAMESPACE = "recommender"
+
+_NULL_CONTEXT = nullcontext()
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters and latency histograms.
+    """
+
+    def __init__(self, enabled=False, buckets=LATENCY_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> _Histogram
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Adds value to a counter.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration in a histogram.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def timer(self, name, **labels):
+        """
+        Context manager recording the duration of its block in histogram name.
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, name, labels)
+
+    def stage(self, stage):
+        """
+        Times one stage of a request, in the stage_seconds histogram.
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, "stage_seconds", {"stage": stage})
+
+    def snapshot(self):
+        """
+        Returns {"counters": [...], "histograms": [...]}, JSON-serializable.
+        Histogram buckets are cumulative, keyed by upper bound.
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = []
+            for (name, labels), histogram in sorted(self._histograms.items(),
+                                                    key=lambda item: item[0]):
+                cumulative, total = {}, 0
+                for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                    total += count
+                    cumulative[str(bound)] = total
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": cumulative,
+                })
+        return {"enabled": self.enabled, "counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        """
+        The snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        for counter in snapshot["counters"]:
+            name = f"{NAMESPACE}_{counter['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(counter['labels'])} {counter['value']}")
+
+        for histogram in snapshot["histograms"]:
+            name = f"{NAMESPACE}_{histogram['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in histogram["buckets"].items():
+                labels = dict(histogram["labels"], le=bound)
+                lines.append(f"{name}_bucket{_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_labels(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{_labels(histogram['labels'])} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+# Process-wide registry used by the recommendation path
+METRICS = Metrics(enabled=os.environ.get("RECOMMENDER_METRICS") == "1")
@@ -0,0 +1,216 @@
+"""
+Approximate Jaccard search over recipes with MinHash signatures and banded
+LSH tables.
+
+Each recipe's ingredient set is summarized by num_perm MinHash values. The
+signature is cut into `bands` bands of num_perm / bands values; two sets
+land in the same bucket of a band with probability s ** rows_per_band, for
+Jaccard similarity s. More bands raise recall (and candidates to re-rank),
+more rows per band make buckets more selective and queries faster.
+Candidates are re-ranked by their exact Jaccard similarity.
+
+Served as the "approx_jaccard" mode of RecommenderIndex.recommend, which
+also drops deleted recipes and ranks pending upserts; MinHashLSH.recommend
+works on a single engine only.
+
+Usage:
+    python minhash_lsh.py [matrix.csv or compiled index]
+prints a recall/latency report for a few settings.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# Mersenne prime for the universal hash family h(x) = (a * x + b) mod PRIME
+PRIME = (1 << 31) - 1
+# Hashes are below PRIME, so signatures are stored as uint32
+EMPTY_HASH = np.iinfo(np.uint32).max
+
+# Rows hashed at a time when computing signatures
+SIGNATURE_CHUNK_ROWS = 16384
+
+# Default settings, the cheapest measured to reach RECALL_TARGET (recall@10 of
+# recall_report on perturbed recipes of the bundled catalog): 96 values in 32
+# bands of 3 give 0.95 recall re-ranking ~30% of the recipes, where 64 values
+# in 16 bands of 4 only reach 0.69. Re-measure when the catalog changes.
+RECALL_TARGET = 0.95
+DEFAULT_NUM_PERM = 96
+DEFAULT_BANDS = 32
+
+
+class MinHashLSH:
+    """
+    Banded MinHash LSH tables over the recipes of a ScoringEngine.
+    """
+
+    def __init__(self, engine, num_perm=DEFAULT_NUM_PERM, bands=DEFAULT_BANDS, seed=1):
+        """
+        Args:
+            engine: ScoringEngine whose recipes are indexed
+            num_perm: MinHash values per signature
+            bands: LSH bands; must divide num_perm
+            seed: seed of the hash functions
+        """
+        if num_perm % bands:
+            raise ValueError(f"bands ({bands}) must divide num_perm ({num_perm})")
+
+        from scipy import sparse
+
+        self.engine = engine
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, PRIME, size=num_perm, dtype=np.int64)
+        b = rng.integers(0, PRIME, size=num_perm, dtype=np.int64)
+        columns = np.arange(len(engine.ingredients), dtype=np.int64)
+        # Hash of every ingredient column under every permutation: num_perm x V
+        self.column_hashes = ((a[:, None] * columns[None, :] + b[:, None])
+                              % PRIME).astype(np.uint32)
+        # Odd multipliers that fold one band of a signature into a 64-bit key
+        self.band_multipliers = rng.integers(1, 1 << 62, size=self.rows_per_band,
+                                             dtype=np.int64).astype(np.uint64) * 2 + 1
+
+        self.signatures = self._signatures(sparse.csr_matrix(engine.matrix))
+
+        # Per band: bucket keys sorted, with the recipe rows in the same order
+        self.band_keys = []
+        self.band_rows = []
+        for band in range(bands):
+            keys = self._band_keys(self.signatures, band)
+            order = np.argsort(keys, kind="stable")
+            self.band_keys.append(keys[order])
+            self.band_rows.append(order)
+
+    def _signatures(self, matrix):
+        matrix.sort_indices()
+        signatures = np.full((matrix.shape[0], self.num_perm), EMPTY_HASH, dtype=np.uint32)
+
+        for start in range(0, matrix.shape[0], SIGNATURE_CHUNK_ROWS):
+            block = matrix[start:start + SIGNATURE_CHUNK_ROWS]
+            non_empty = np.flatnonzero(np.diff(block.indptr))
+            if not len(non_empty):
+                continue
+            # Minimum of the column hashes over each recipe's ingredients
+            hashes = self.column_hashes[:, block.indices]
+            minima = np.minimum.reduceat(hashes, block.indptr[non_empty], axis=1)
+            signatures[start + non_empty] = minima.T
+        return signatures
+
+    def _band_keys(self, signatures, band):
+        # One signature column at a time, so only the keys are 64-bit
+        start = band * self.rows_per_band
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for col, multiplier in enumerate(self.band_multipliers):
+            keys += signatures[:, start + col].astype(np.uint64) * multiplier
+        return keys
+
+    def query_signature(self, ingredients_available):
+        cols = self.engine.query_columns(ingredients_available)[0]
+        if not len(cols):
+            return np.full(self.num_perm, EMPTY_HASH, dtype=np.uint32)
+        return self.column_hashes[:, cols].min(axis=1)
+
+    def candidates(self, ingredients_available):
+        """
+        Rows of the recipes sharing at least one band bucket with the pantry.
+        """
+        signature = self.query_signature(ingredients_available)
+        if signature[0] == EMPTY_HASH:
+            return np.empty(0, dtype=np.intp)
+
+        found = []
+        for band in range(self.bands):
+            key = self._band_keys(signature[None, :], band)[0]
+            band_keys = self.band_keys[band]
+            start = np.searchsorted(band_keys, key, side="left")
+            end = np.searchsorted(band_keys, key, side="right")
+            found.append(self.band_rows[band][start:end])
+        return np.unique(np.concatenate(found))
+
+    def estimated_jaccard(self, ingredients_available, rows):
+        signature = self.query_signature(ingredients_available)
+        return (self.signatures[rows] == signature).mean(axis=1)
+
+    def recommend(self, ingredients_available, num_recipes):
+        """
+        Returns up to num_recipes (recipe_name, jaccard) pairs, best first,
+        among the LSH candidates, re-ranked by exact Jaccard similarity.
+        """
+        rows = self.candidates(ingredients_available)
+        if not len(rows):
+            return []
+
+        similarity = self.engine.jaccard(ingredients_available, rows)
+        order = np.argsort(-similarity, kind="stable")[:num_recipes]
+        names = self.engine.recipe_names
+        return [(names[rows[i]], float(similarity[i])) for i in order]
+
+
+def recall_report(lsh, queries, k=10):
+    """
+    Compares lsh.recommend with the exact Jaccard ranking
+    (ScoringEngine.recommend_by_jaccard) on a list of ingredient lists.
+
+    Recall counts an approximate result as correct when its similarity is at
+    least the exact k-th best similarity, so ties do not count as misses.
+    Queries whose exact top-k are all 0 are skipped.
+    """
+    engine = lsh.engine
+    recalls, candidates = [], []
+    exact_time = approx_time = 0.0
+
+    for ingredients_available in queries:
+        start = time.perf_counter()
+        exact = engine.recommend_by_jaccard(ingredients_available, k)
+        exact_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        approx = lsh.recommend(ingredients_available, k)
+        approx_time += time.perf_counter() - start
+
+        relevant = [similarity for _, similarity in exact if similarity > 0]
+        if not relevant:
+            continue
+        threshold = relevant[-1]
+        hits = sum(1 for _, similarity in approx if similarity >= threshold)
+        recalls.append(min(hits, len(relevant)) / len(relevant))
+        candidates.append(len(lsh.candidates(ingredients_available)))
+
+    num_queries = max(len(queries), 1)
+    return {
+        "num_perm": lsh.num_perm,
+        "bands": lsh.bands,
+        "rows_per_band": lsh.rows_per_band,
+        "k": k,
+        "queries": len(recalls),
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "mean_candidates": float(np.mean(candidates)) if candidates else 0.0,
+        "candidate_fraction": (float(np.mean(candidates)) / max(len(engine.recipe_names), 1)
+                               if candidates else 0.0),
+        "exact_ms": 1000 * exact_time / num_queries,
+        "approx_ms": 1000 * approx_time / num_queries,
+    }
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from recommender_index import RecommenderIndex
+
+    index = RecommenderIndex(sys.argv[1] if len(sys.argv) > 1 else None)
+    engine = index.engine
+
+    # Use recipes' own ingredient sets, slightly perturbed, as pantries
+    rng = np.random.default_rng(0)
+    queries = []
+    for row in rng.choice(len(engine.recipe_names), size=200):
+        cols = np.flatnonzero(np.unpackbits(engine.packed[row])[:len(engine.ingredients)])
+        keep = cols[rng.random(len(cols)) < 0.8]
+        queries.append([engine.ingredients[col] for col in keep])
+
+    for num_perm, bands in [(64, 16), (60, 20), (DEFAULT_NUM_PERM, DEFAULT_BANDS), (128, 64)]:
+        print(recall_report(MinHashLSH(engine, num_perm, bands), queries))
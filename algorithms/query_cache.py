@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Bounded, thread-safe result cache with LRU eviction and a time-to-live.
+    Keeps hit / miss / eviction counters.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        """
+        Args:
+            maxsize: maximum number of entries; 0 disables the cache
+            ttl: seconds an entry stays valid, None for no expiry
+            clock: time source, monotonic seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key, or default on a miss or expired entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns a dict of size, hits, misses, evictions and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
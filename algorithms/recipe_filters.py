@@ -0,0 +1,154 @@
+"""
+Recipe filters compiled to precomputed recipe bitmasks.
+
+A RecipeFilter lists required / excluded ingredients and ingredient
+categories (the categories of ing_map.ingredients: meat, fish_seafood,
+dairy_eggs, ...). FilterMasks keeps one bit-packed recipe mask per
+ingredient, built from the matrix column, and one per category, the OR of
+its ingredients' masks; both are built on first use and reused. A filter is
+then a handful of AND / AND NOT operations over packed masks, done before
+scoring, so only the recipes it allows are scored.
+"""
+
+import numpy as np
+from scipy import sparse
+
+# Categories excluded by the dietary shortcuts of RecipeFilter.for_diet
+DIETS = {
+    "vegetarian": ("meat", "fish_seafood"),
+    "pescatarian": ("meat",),
+    "vegan": ("meat", "fish_seafood", "dairy_eggs"),
+}
+
+
+def category_ingredients():
+    """
+    {category: [ingredient, ...]} of the ingredient taxonomy.
+    """
+    from data_process_pipelines.ingr_recip_matrx_pipeline.ing_map import ingredients
+
+    # "remove" is a plain list of dropped raw names, not a category
+    return {category: list(members) for category, members in ingredients.items()
+            if isinstance(members, dict)}
+
+
+class RecipeFilter:
+    """
+    Constraints on the recipes a query may return: every required
+    ingredient and at least one ingredient of every required category must
+    be used; no excluded ingredient and no ingredient of an excluded
+    category may be used.
+    """
+
+    def __init__(self, required_ingredients=(), excluded_ingredients=(),
+                 required_categories=(), excluded_categories=()):
+        self.required_ingredients = frozenset(required_ingredients)
+        self.excluded_ingredients = frozenset(excluded_ingredients)
+        self.required_categories = frozenset(required_categories)
+        self.excluded_categories = frozenset(excluded_categories)
+
+    @classmethod
+    def for_diet(cls, diet, **constraints):
+        """
+        Filter excluding the categories of a DIETS entry, plus constraints.
+        """
+        if diet not in DIETS:
+            raise ValueError(f"Unknown diet '{diet}', expected one of {tuple(DIETS)}")
+        excluded = set(DIETS[diet]) | set(constraints.pop("excluded_categories", ()))
+        return cls(excluded_categories=excluded, **constraints)
+
+    @property
+    def key(self):
+        """
+        Hashable, order-independent form, for cache keys.
+        """
+        return tuple(tuple(sorted(constraint)) for constraint in (
+            self.required_ingredients, self.excluded_ingredients,
+            self.required_categories, self.excluded_categories,
+        ))
+
+    def __bool__(self):
+        return any(self.key)
+
+    def __repr__(self):
+        return ("RecipeFilter(required_ingredients={}, excluded_ingredients={}, "
+                "required_categories={}, excluded_categories={})".format(*self.key))
+
+
+class FilterMasks:
+    """
+    Bit-packed recipe masks (numpy.packbits over the rows) of the
+    ingredients and categories of a ScoringEngine, built on first use.
+    """
+
+    def __init__(self, engine, categories=None, inverted_index=None):
+        """
+        Args:
+            engine: ScoringEngine whose rows the masks cover
+            categories: {category: [ingredient, ...]}, defaults to the
+                        ing_map taxonomy
+            inverted_index: InvertedIndex of engine whose posting lists are
+                            reused, else the matrix columns are read directly
+        """
+        self.engine = engine
+        self.num_recipes = len(engine.recipe_names)
+        self.categories = categories if categories is not None else category_ingredients()
+        self.inverted_index = inverted_index
+
+        self._postings = None
+        self._ingredient_masks = {}
+        self._category_masks = {}
+
+    def _posting_list(self, col):
+        if self.inverted_index is not None:
+            return self.inverted_index.posting_list(col)
+        if self._postings is None:
+            self._postings = sparse.csc_matrix(self.engine.matrix)
+        postings = self._postings
+        return postings.indices[postings.indptr[col]:postings.indptr[col + 1]]
+
+    def _mask_of_rows(self, rows):
+        used = np.zeros(self.num_recipes, dtype=bool)
+        used[rows] = True
+        return np.packbits(used)
+
+    def ingredient_mask(self, ingredient):
+        """
+        Recipes using ingredient (none for an unknown ingredient).
+        """
+        mask = self._ingredient_masks.get(ingredient)
+        if mask is None:
+            col = self.engine.column_index.get(ingredient)
+            rows = self._posting_list(col) if col is not None else []
+            mask = self._ingredient_masks[ingredient] = self._mask_of_rows(rows)
+        return mask
+
+    def category_mask(self, category):
+        """
+        Recipes using at least one ingredient of category.
+        """
+        mask = self._category_masks.get(category)
+        if mask is None:
+            if category not in self.categories:
+                raise ValueError(f"Unknown category '{category}', expected one of "
+                                 f"{tuple(self.categories)}")
+            cols = [self.engine.column_index[ingr] for ingr in self.categories[category]
+                    if ingr in self.engine.column_index]
+            rows = np.concatenate([self._posting_list(col) for col in cols] or [[]])
+            mask = self._category_masks[category] = self._mask_of_rows(rows.astype(np.intp))
+        return mask
+
+    def allowed(self, recipe_filter):
+        """
+        Boolean array over the rows: True for the recipes recipe_filter allows.
+        """
+        allowed = np.packbits(np.ones(self.num_recipes, dtype=bool))
+        for ingredient in recipe_filter.required_ingredients:
+            allowed &= self.ingredient_mask(ingredient)
+        for category in recipe_filter.required_categories:
+            allowed &= self.category_mask(category)
+        for ingredient in recipe_filter.excluded_ingredients:
+            allowed &= ~self.ingredient_mask(ingredient)
+        for category in recipe_filter.excluded_categories:
+            allowed &= ~self.category_mask(category)
+        return np.unpackbits(allowed, count=self.num_recipes).view(bool)
@@ -0,0 +1,348 @@
+"""
+Standalone asyncio HTTP recommendation service (standard library only).
+
+The catalog is loaded once at start-up. Concurrent weighted requests that
+arrive within max_delay of each other are coalesced by a MicroBatcher into
+one RecommenderIndex.recommend_batch call (one matrix-matrix product per
+chunk), run in a worker thread so the event loop keeps accepting requests.
+Pantries found in the index's QueryCache skip the batch; batch results fill it.
+
+Endpoints:
+    POST /recommend  {"ingredients": [...], "num_recipes": 10, "mode": "weighted",
+                      "max_missing": null, "confidences": null,
+                      "weight_overrides": null, "filters": null,
+                      "diversity": null, "explain": false}
+                     filters: {"diet": "vegetarian", "required_ingredients": [...],
+                               "excluded_ingredients": [...], "required_categories": [...],
+                               "excluded_categories": [...]}, every key optional
+    GET  /health     catalog size and version
+    GET  /stats      batching and cache counters
+    GET  /metrics    stage timings and counters (Prometheus text; see metrics.py)
+
+Usage:
+    python recommendation_service.py [matrix.csv or compiled index] [port]
+    curl -d '{"ingredients": ["tomate", "oignon"]}' localhost:8000/recommend
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+from metrics import METRICS
+from recipe_filters import RecipeFilter
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+# Requests arriving within MAX_DELAY seconds are scored together
+MAX_DELAY = 0.002
+MAX_BATCH = 256
+
+MAX_BODY_BYTES = 1 << 20
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class MicroBatcher:
+    """
+    Coalesces weighted top-k requests into batched scoring calls.
+    A batch is flushed max_delay seconds after its first request, or as
+    soon as it holds max_batch requests. It is scored for the largest
+    requested k; every request gets the prefix of its own length, which is
+    its exact ranking.
+    """
+
+    def __init__(self, index, max_delay=MAX_DELAY, max_batch=MAX_BATCH):
+        self.index = index
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+
+        self.requests = 0
+        self.batches = 0
+
+        self._pending = []  # (ingredients, k, cache key, future)
+        self._timer = None
+
+    async def recommend(self, ingredients_available, k):
+        # Cached pantries are answered without waiting for a batch
+        key, cached = self.index.cached_recommendation(ingredients_available, k)
+        if cached is not None:
+            METRICS.inc("queries_total", mode="weighted")
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((ingredients_available, k, key, future))
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        self.requests += len(batch)
+        self.batches += 1
+        k = max(k for _, k, _, _ in batch)
+        ingredient_lists = [ingredients for ingredients, _, _, _ in batch]
+
+        METRICS.inc("queries_total", len(batch), mode="batch")
+        loop = asyncio.get_running_loop()
+        try:
+            with METRICS.timer("request_seconds", entry="service_batch"):
+                results = await loop.run_in_executor(None, self.index.recommend_batch,
+                                                     ingredient_lists, k, None, True)
+        except Exception as exc:
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (_, k, key, future), result in zip(batch, results):
+            # Keyed by the version seen at lookup; the batch scored that
+            # version or a newer one, so the entry is never stale
+            self.index.cache.put(key, tuple(result[:k]))
+            if not future.done():
+                future.set_result(result[:k])
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+class RequestError(Exception):
+    """
+    A client error, answered with its HTTP status.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RecommendationService:
+    """
+    HTTP front end of a RecommenderIndex.
+    """
+
+    def __init__(self, index, max_delay=MAX_DELAY, max_batch=MAX_BATCH):
+        self.index = index
+        self.batcher = MicroBatcher(index, max_delay, max_batch)
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        # Load (or map) the catalog once, before accepting connections
+        state = await loop.run_in_executor(None, lambda: self.index.state)
+        print(f"Serving {len(state.base.recipe_names)} recipes on http://{host}:{port}")
+
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection until the client closes
+        it or asks to.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        method, path, version = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = (connection != "close" if version.strip() == "HTTP/1.1"
+                      else connection == "keep-alive")
+
+        try:
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_BYTES:
+                keep_alive = False
+                raise RequestError(413, f"Body larger than {MAX_BODY_BYTES} bytes")
+            body = await reader.readexactly(length) if length else b""
+            status, payload = 200, await self._route(method, path, body)
+        except RequestError as exc:
+            status, payload = exc.status, {"error": str(exc)}
+        except ValueError as exc:
+            status, payload = 400, {"error": str(exc)}
+        except Exception as exc:
+            status, payload = 500, {"error": f"{type(exc).__name__}: {exc}"}
+
+        if isinstance(payload, str):
+            data, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            data = json.dumps(payload, ensure_ascii=False).encode()
+            content_type = "application/json"
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+            + data
+        )
+        return keep_alive
+
+    async def _route(self, method, path, body):
+        path = path.split("?", 1)[0]
+        routes = {
+            "/recommend": ("POST", self._recommend),
+            "/health": ("GET", self._health),
+            "/stats": ("GET", self._stats),
+            "/metrics": ("GET", self._metrics),
+        }
+        if path not in routes:
+            raise RequestError(404, f"Unknown path '{path}'")
+        expected, handler = routes[path]
+        if method != expected:
+            raise RequestError(405, f"{path} expects {expected}")
+        return await handler(body)
+
+    async def _recommend(self, body):
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError as exc:
+            raise RequestError(400, f"Invalid JSON: {exc}")
+        if not isinstance(request, dict):
+            raise RequestError(400, "Expected a JSON object")
+
+        ingredients = request.get("ingredients")
+        if not isinstance(ingredients, list) or not all(isinstance(i, str) for i in ingredients):
+            raise RequestError(400, "'ingredients' must be a list of strings")
+        num_recipes = request.get("num_recipes", 10)
+        if not isinstance(num_recipes, int) or num_recipes < 0:
+            raise RequestError(400, "'num_recipes' must be a non-negative integer")
+        mode = request.get("mode", "weighted")
+        max_missing = request.get("max_missing")
+        if max_missing is not None and (not isinstance(max_missing, int) or max_missing < 0):
+            raise RequestError(400, "'max_missing' must be a non-negative integer")
+        confidences = request.get("confidences")
+        if confidences is not None and (not isinstance(confidences, list)
+                                        or not all(_is_number(c) for c in confidences)):
+            raise RequestError(400, "'confidences' must be a list of numbers")
+        weight_overrides = request.get("weight_overrides")
+        if weight_overrides is not None and (
+                not isinstance(weight_overrides, dict)
+                or not all(_is_number(w) for w in weight_overrides.values())):
+            raise RequestError(400, "'weight_overrides' must be an object of numbers")
+        recipe_filter = _recipe_filter(request.get("filters"))
+        diversity = request.get("diversity")
+        if diversity is not None and not _is_number(diversity):
+            raise RequestError(400, "'diversity' must be a number between 0 and 1")
+        explain = request.get("explain", False)
+        if not isinstance(explain, bool):
+            raise RequestError(400, "'explain' must be a boolean")
+
+        if (mode == "weighted" and confidences is None and not weight_overrides
+                and not recipe_filter and diversity is None and not explain):
+            result = await self.batcher.recommend(ingredients, num_recipes)
+        else:
+            # Other modes, per-request weighting, filters, diversity and
+            # explanations are scored one by one
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                None, lambda: self.index.recommend(ingredients, num_recipes, mode,
+                                                   max_missing, confidences,
+                                                   weight_overrides, with_ids=True,
+                                                   recipe_filter=recipe_filter,
+                                                   diversity=diversity, explain=explain)
+            )
+        return {"mode": mode, "recipes": _result_records(mode, result, explain)}
+
+    async def _health(self, body):
+        return {"status": "ok", "recipes": len(self.index.engine.recipe_names),
+                "version": self.index.version}
+
+    async def _stats(self, body):
+        return {"batching": self.batcher.stats(), "cache": self.index.cache.stats()}
+
+    async def _metrics(self, body):
+        return METRICS.prometheus_text()
+
+
+FILTER_FIELDS = ("required_ingredients", "excluded_ingredients", "required_categories",
+                 "excluded_categories")
+
+
+def _is_number(value):
+    # JSON numbers; true and false decode to bool, a subclass of int
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _recipe_filter(filters):
+    # The "filters" object of a request as a RecipeFilter (None if absent)
+    if filters is None:
+        return None
+    if not isinstance(filters, dict):
+        raise RequestError(400, "'filters' must be a JSON object")
+    unknown = set(filters) - set(FILTER_FIELDS) - {"diet"}
+    if unknown:
+        raise RequestError(400, f"Unknown filters {sorted(unknown)}")
+    constraints = {}
+    for field in FILTER_FIELDS:
+        values = filters.get(field, [])
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise RequestError(400, f"'filters.{field}' must be a list of strings")
+        constraints[field] = values
+    if filters.get("diet") is not None:
+        return RecipeFilter.for_diet(filters["diet"], **constraints)
+    return RecipeFilter(**constraints)
+
+
+def _result_records(mode, result, explain=False):
+    # recommend(with_ids=True) tuples as JSON objects; explanations (the last
+    # field) go under "explanation"
+    if explain:
+        records = _result_records(mode, [item[:-1] for item in result])
+        return [dict(record, explanation=item[-1]) for record, item in zip(records, result)]
+    if mode == "coverage":
+        return [{"id": recipe_id, "title": title, "coverage": coverage, "missing": missing}
+                for recipe_id, title, coverage, missing in result]
+    if mode in ("jaccard", "approx_jaccard"):
+        return [{"id": recipe_id, "title": title, "similarity": similarity}
+                for recipe_id, title, similarity in result]
+    return [{"id": recipe_id, "title": title, "score": score}
+            for recipe_id, title, score in result]
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from recommender_index import RecommenderIndex
+
+    index = RecommenderIndex(sys.argv[1] if len(sys.argv) > 1 else None)
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PORT
+    METRICS.enable()
+    try:
+        asyncio.run(RecommendationService(index).serve(DEFAULT_HOST, port))
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,3 @@
-import pandas as pd 
-import numpy as np
 import sys
 import os
 
@@ -9,49 +7,105 @@ pipeline_path = os.path.join(os.path.dirname(__file__), '..',
                              'ingr_recip_matrx_pipeline')
 sys.path.append(pipeline_path)
 
-# Use relative path for deployment compatibility
-matrix_path = os.path.join(os.path.dirname(__file__), '..', 'datasets',
-                           'recipe_ingredient_matrix_VF.csv')
-matrix = pd.read_csv(matrix_path, index_col=0)
-recipe_names = list(matrix.index)
+# Nothing is loaded at import: the shared index reads the matrix on first use
+from recommender_index import DEFAULT_MATRIX_PATH, RecommenderIndex, get_index
+from metrics import METRICS
 
-from ingredient_weights import INGREDIENT_WEIGHTS
+matrix_path = DEFAULT_MATRIX_PATH
 
 
-def compute_recipe_score(ingredients_available, recipe):
+def __getattr__(name):
+    # Former import-time globals, resolved from the shared index on first access
+    if name == "scoring_engine":
+        return get_index().engine
+    if name == "inverted_index":
+        return get_index().inverted_index
+    if name == "recipe_names":
+        return get_index().recipe_names
+    # Re-exported on first access: recipe_filters loads numpy and scipy
+    if name == "RecipeFilter":
+        from recipe_filters import RecipeFilter
+        return RecipeFilter
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def compute_recipe_score(ingredients_available, recipe, confidences=None,
+                         weight_overrides=None):
     """
     Computes weighted score of a recipe given a list of available ingredients.
+    recipe is a recipe ID, or a title (the first recipe with that title).
+    confidences (one per ingredient) scale the ingredient weights and
+    weight_overrides ({ingredient: weight}) replace them, for this call only.
     """
-    score = 0
-    
-    for ingr in ingredients_available:
-        if ingr in matrix.columns:
-            # Get the value and convert to scalar if needed
-            ingredient_value = matrix.loc[recipe, ingr]
-            
-            # Handle the case where it returns a Series
-            if isinstance(ingredient_value, pd.Series):
-                ingredient_value = ingredient_value.iloc[0]
-            
-            # Convert to int to avoid any ambiguity
-            ingredient_value = int(ingredient_value)
-            
-            if ingredient_value == 1:
-                # Get weight for this ingredient (default to 2 if not found)
-                weight = INGREDIENT_WEIGHTS.get(ingr, 2)
-                score += weight
-                    
-    return score
-
-
-def recommend_recipes(ingredients_available, num_recipes):
+    with METRICS.timer("request_seconds", entry="compute_recipe_score"):
+        return get_index().score_recipe(ingredients_available, recipe, confidences,
+                                        weight_overrides)
+
+
+def recommend_recipes(ingredients_available, num_recipes, mode="weighted",
+                      max_missing=None, confidences=None, weight_overrides=None,
+                      with_ids=False, recipe_filter=None, diversity=None, explain=False):
     """
     Recommends the most adequate recipes according to a list of available
     ingredients using weighted scoring.
+    Each ingredient counts with its INGREDIENT_WEIGHTS weight, replaced by
+    weight_overrides[ingredient] if given, times its confidence if
+    confidences (one per ingredient) are given.
+    mode="coverage" ranks "cook with what I have" style instead: by the
+    fraction of each recipe's ingredients available, then fewest missing,
+    keeping only recipes lacking at most max_missing ingredients if given.
+    mode="jaccard" ranks by Jaccard similarity between the pantry and each
+    recipe's ingredient set; mode="approx_jaccard" ranks the same way among
+    MinHash/LSH candidates only, faster on large catalogs but approximate.
+    with_ids=True prefixes every result with its integer recipe ID, which
+    tells apart recipes sharing a title.
+    recipe_filter limits the results to the recipes it allows, e.g.
+    RecipeFilter(excluded_categories=["meat"]) or
+    RecipeFilter.for_diet("vegetarian", required_ingredients=["tomato"]).
+    diversity (0 to 1) re-ranks the best few hundred candidates so that
+    near-identical recipes do not fill the top of the list.
+    explain=True appends to every result its matched and missing ingredient
+    IDs and per-category score contributions (see RecommenderIndex.explain).
+    See RecommenderIndex.recommend for the result format.
+    """
+    with METRICS.timer("request_seconds", entry="recommend_recipes"):
+        return get_index().recommend(ingredients_available, num_recipes, mode, max_missing,
+                                     confidences, weight_overrides, with_ids, recipe_filter,
+                                     diversity, explain)
+
+
+def recommend_from_features(recipe_features, num_recipes, weight_overrides=None,
+                            with_ids=False):
+    """
+    Recommends recipes for the output of
+    ml_integration.ingredients_to_recipe_features, weighting each detected
+    ingredient by its detection confidence.
+    """
+    return recommend_recipes(recipe_features['ingredients'], num_recipes,
+                             confidences=recipe_features['confidence_weights'],
+                             weight_overrides=weight_overrides, with_ids=with_ids)
+
+
+def recommend_recipes_batch(list_of_ingredient_lists, k, chunk_size=None, with_ids=False):
+    """
+    Recommends the k best recipes for each ingredient list of a batch.
+    All queries of a chunk are scored with one matrix-matrix product; see
+    ScoringEngine.recommend_batch for the chunking.
+    """
+    METRICS.inc("queries_total", len(list_of_ingredient_lists), mode="batch")
+    with METRICS.timer("request_seconds", entry="recommend_recipes_batch"):
+        return get_index().recommend_batch(list_of_ingredient_lists, k, chunk_size,
+                                           with_ids)
+
+
+def metrics_snapshot(format="json"):
+    """
+    Returns the recorded stage timings and counters, as a dict ("json") or
+    as Prometheus text ("prometheus"). Recording is off until
+    METRICS.enable() is called or RECOMMENDER_METRICS=1 is set.
     """
-    scores = {}
-    for recipe in recipe_names:
-        recipe_score = compute_recipe_score(ingredients_available, recipe)
-        scores[recipe] = recipe_score
-    sorted_recipes = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return sorted_recipes[:num_recipes]
+    if format == "prometheus":
+        return METRICS.prometheus_text()
+    if format == "json":
+        return METRICS.snapshot()
+    raise ValueError(f"Unknown format '{format}', expected 'json' or 'prometheus'")
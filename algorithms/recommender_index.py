@@ -0,0 +1,1064 @@
+import os
+import threading
+
+from metrics import METRICS
+
+# Use relative path for deployment compatibility
+DEFAULT_MATRIX_PATH = os.path.join(os.path.dirname(__file__), '..', 'datasets',
+                                   'recipe_ingredient_matrix_VF.csv')
+
+# Pending updates (upserted rows + tombstones) that trigger a background merge
+MERGE_THRESHOLD = 1000
+
+# "weighted": sum of matched ingredient weights
+# "coverage": fraction of the recipe's ingredients in the pantry, then fewest missing
+# "jaccard": exact Jaccard similarity between pantry and recipe ingredient sets
+# "approx_jaccard": the same similarity, over MinHash/LSH candidates only
+RANKING_MODES = ("weighted", "coverage", "jaccard", "approx_jaccard")
+
+# Explanation category of ingredients outside the INGREDIENT_WEIGHTS categories
+OTHER_CATEGORY = "other"
+
+
+class _IndexState:
+    """
+    Immutable snapshot of a catalog: the base engine, the append-only delta
+    segment of recipes upserted since the last merge, tombstones for both,
+    and the ingredient columns added since the last merge.
+    Updates build a new state, so a query always sees one consistent snapshot.
+    Positions number the base rows first, then the delta rows, which is also
+    the row order of the merged catalog.
+    Upserted recipes get new IDs above every ID handed out before, so IDs
+    increase with the position and a deleted ID is never reused.
+    """
+
+    def __init__(self, base, version, base_deleted=frozenset(), delta_titles=(),
+                 delta_ingredients=(), delta_deleted=frozenset(), new_columns=(),
+                 delta_ids=(), next_id=None):
+        self.base = base
+        self.version = version
+        self.base_deleted = base_deleted
+        self.delta_titles = delta_titles
+        self.delta_ingredients = delta_ingredients
+        self.delta_deleted = delta_deleted
+        self.new_columns = new_columns  # ((ingredient, weight), ...)
+        self.delta_ids = delta_ids
+        if next_id is None:
+            next_id = int(base.recipe_ids[-1]) + 1 if len(base.recipe_ids) else 0
+        self.next_id = next_id
+
+        self.num_base = len(base.recipe_names)
+        self.new_column_weights = dict(new_columns)
+        self.ingredients = list(base.ingredients) + [ingr for ingr, _ in new_columns]
+        # Upserts replace every live recipe with the same title, so a title
+        # has at most one live delta position
+        self.delta_index = {title: pos for pos, title in enumerate(delta_titles)
+                            if pos not in delta_deleted}
+        self.delta_id_index = {recipe_id: pos for pos, recipe_id in enumerate(delta_ids)
+                               if pos not in delta_deleted}
+        self._delta = None
+        self._delta_masks = None
+        self._column_categories = None
+
+    def replace(self, **changes):
+        fields = {
+            "base": self.base,
+            "version": self.version,
+            "base_deleted": self.base_deleted,
+            "delta_titles": self.delta_titles,
+            "delta_ingredients": self.delta_ingredients,
+            "delta_deleted": self.delta_deleted,
+            "new_columns": self.new_columns,
+            "delta_ids": self.delta_ids,
+            "next_id": self.next_id,
+        }
+        fields.update(changes)
+        return _IndexState(**fields)
+
+    @property
+    def has_updates(self):
+        return bool(self.base_deleted or self.delta_titles or self.new_columns)
+
+    @property
+    def pending_updates(self):
+        return len(self.delta_titles) + len(self.base_deleted)
+
+    @property
+    def weights(self):
+        """
+        {ingredient: weight} over base and added columns.
+        """
+        weights = dict(zip(self.base.ingredients, self.base.weights.tolist()))
+        weights.update(self.new_columns)
+        return weights
+
+    @property
+    def delta(self):
+        """
+        ScoringEngine over the delta segment, built on first use.
+        """
+        if self._delta is None:
+            from scoring_engine import ScoringEngine
+            self._delta = ScoringEngine.from_ingredient_lists(
+                self.delta_titles, self.delta_ingredients, self.ingredients, self.weights,
+                recipe_ids=self.delta_ids,
+            )
+        return self._delta
+
+    @property
+    def delta_masks(self):
+        """
+        FilterMasks over the delta segment, built on first use.
+        """
+        if self._delta_masks is None:
+            from recipe_filters import FilterMasks
+            self._delta_masks = FilterMasks(self.delta)
+        return self._delta_masks
+
+    def base_alive(self):
+        import numpy as np
+
+        alive = np.ones(self.num_base, dtype=bool)
+        alive[list(self.base_deleted)] = False
+        return alive
+
+    def delta_alive(self):
+        import numpy as np
+
+        alive = np.ones(len(self.delta_titles), dtype=bool)
+        alive[list(self.delta_deleted)] = False
+        return alive
+
+    def has_ingredient(self, ingredient):
+        return ingredient in self.base.column_index or ingredient in self.new_column_weights
+
+    def canonical_query(self, ingredients_available, confidences=None):
+        """
+        Order-independent form of an ingredient list: the known ingredients,
+        sorted, with repeats kept since they change the score, each paired
+        with its confidence when confidences are given.
+        Two lists with the same canonical form get the same recommendations.
+        """
+        if confidences is not None and len(confidences) != len(ingredients_available):
+            raise ValueError(f"Got {len(confidences)} confidences for "
+                             f"{len(ingredients_available)} ingredients")
+        if confidences is None:
+            return tuple(sorted(ingr for ingr in ingredients_available
+                                if self.has_ingredient(ingr)))
+        return tuple(sorted((ingr, float(confidence))
+                            for ingr, confidence in zip(ingredients_available, confidences)
+                            if self.has_ingredient(ingr)))
+
+    def positions_of(self, recipe):
+        """
+        Positions of the live recipes with this ID (an int) or title (a
+        str), in position order. A title can match several recipes.
+        """
+        import numpy as np
+
+        if isinstance(recipe, (int, np.integer)):
+            pos = self.delta_id_index.get(int(recipe))
+            if pos is not None:
+                return [self.num_base + pos]
+            row = int(self.base.id_rows([recipe])[0])
+            return [row] if row >= 0 and row not in self.base_deleted else []
+
+        positions = [row for row in self.base.title_rows(recipe)
+                     if row not in self.base_deleted]
+        pos = self.delta_index.get(recipe)
+        if pos is not None:
+            positions.append(self.num_base + pos)
+        return positions
+
+    def locate(self, recipe):
+        """
+        Returns ("base", row) or ("delta", pos) for the first live recipe with
+        this ID or title, else None.
+        """
+        positions = self.positions_of(recipe)
+        if not positions:
+            return None
+        if positions[0] < self.num_base:
+            return "base", positions[0]
+        return "delta", positions[0] - self.num_base
+
+    def id_positions(self, recipe_ids):
+        """
+        Positions of the live recipes with the given IDs.
+        """
+        import numpy as np
+
+        positions = self.base.id_rows(recipe_ids)
+        for i in np.flatnonzero(positions < 0):
+            positions[i] = self.num_base + self.delta_id_index[int(recipe_ids[i])]
+        return positions
+
+    def ingredient_block(self, positions):
+        """
+        Dense positions x ingredients 0/1 array of the recipes at positions,
+        over the base and added ingredient columns.
+        """
+        import numpy as np
+        from scipy import sparse
+
+        block = np.zeros((len(positions), len(self.ingredients)))
+        in_base = positions < self.num_base
+        for engine, mask, rows in ((self.base, in_base, positions[in_base]),
+                                   (self.delta, ~in_base, positions[~in_base] - self.num_base)):
+            if len(rows):
+                matrix = engine.matrix[rows]
+                matrix = matrix.toarray() if sparse.issparse(matrix) else matrix
+                block[mask, :matrix.shape[1]] = matrix
+        return block
+
+    def pantry_size(self, ingredients_available):
+        """
+        Number of distinct known pantry ingredients, over base and added columns.
+        """
+        return int(self.query_vector(ingredients_available)[1].sum())
+
+    def query_vector(self, ingredients_available, confidences=None, weight_overrides=None):
+        """
+        Query weights over ingredients (see ScoringEngine.query_columns), and
+        the mask of the columns the query lists.
+        """
+        import numpy as np
+
+        # The delta engine also covers the added columns
+        engine = self.delta if self.new_columns else self.base
+        cols, weights = engine.query_columns(ingredients_available, confidences,
+                                             weight_overrides)
+        vector = np.zeros(len(self.ingredients), dtype=weights.dtype)
+        vector[cols] = weights
+        listed = np.zeros(len(self.ingredients), dtype=bool)
+        listed[cols] = True
+        return vector, listed
+
+    @property
+    def column_categories(self):
+        """
+        (categories, codes): the sorted INGREDIENT_CATEGORIES categories of
+        the ingredient columns, and the index of each column's category.
+        """
+        import numpy as np
+
+        if self._column_categories is None:
+            from ingredient_weights import INGREDIENT_CATEGORIES
+            names = [INGREDIENT_CATEGORIES.get(ingr, OTHER_CATEGORY) for ingr in self.ingredients]
+            categories, codes = np.unique(names, return_inverse=True)
+            self._column_categories = (categories.tolist(), codes)
+        return self._column_categories
+
+    def weight_array(self):
+        """
+        Ingredient weights aligned with ingredients.
+        """
+        import numpy as np
+
+        return np.concatenate([self.base.weights,
+                               [weight for _, weight in self.new_columns]]).astype(np.float64)
+
+    def title_at(self, position):
+        if position < self.num_base:
+            return self.base.recipe_names[position]
+        return self.delta_titles[position - self.num_base]
+
+    def id_at(self, position):
+        if position < self.num_base:
+            return int(self.base.recipe_ids[position])
+        return self.delta_ids[position - self.num_base]
+
+    def alive_positions(self, base_allowed=None, delta_allowed=None):
+        """
+        Live positions in order, restricted to the allowed rows of each
+        segment when allowed masks are given.
+        """
+        import numpy as np
+
+        base_alive, delta_alive = self.base_alive(), self.delta_alive()
+        if base_allowed is not None:
+            base_alive &= base_allowed
+            delta_alive &= delta_allowed
+        return np.concatenate([np.flatnonzero(base_alive),
+                               np.flatnonzero(delta_alive) + self.num_base])
+
+    def at_positions(self, positions, compute):
+        """
+        Evaluates compute(engine, rows) over the base and delta rows of the
+        sorted positions and concatenates the results (arrays, or tuples of
+        arrays). rows is None when positions cover the whole base.
+        """
+        import numpy as np
+
+        split = int(np.searchsorted(positions, self.num_base))
+        base_rows = None if split == self.num_base else positions[:split]
+        parts = [compute(self.base, base_rows)]
+        if split < len(positions):
+            parts.append(compute(self.delta, positions[split:] - self.num_base))
+        if len(parts) == 1:
+            return parts[0]
+        if isinstance(parts[0], tuple):
+            return tuple(np.concatenate(values) for values in zip(*parts))
+        return np.concatenate(parts)
+
+    def without(self, recipe):
+        """
+        Returns a state where the live recipes with this ID or title are
+        tombstoned.
+        """
+        positions = self.positions_of(recipe)
+        if not positions:
+            return self
+        base_rows = {p for p in positions if p < self.num_base}
+        delta_rows = {p - self.num_base for p in positions if p >= self.num_base}
+        return self.replace(base_deleted=self.base_deleted | base_rows,
+                            delta_deleted=self.delta_deleted | delta_rows)
+
+    def compact(self, backend):
+        """
+        Builds the merged base engine. Returns (engine, base_rows, delta_rows)
+        where base_rows / delta_rows map old base rows / delta positions to
+        rows of the new engine (-1 for tombstoned ones).
+        """
+        import numpy as np
+        from scipy import sparse
+        from scoring_engine import ScoringEngine
+
+        base_alive = np.flatnonzero(self.base_alive())
+        delta_alive = np.flatnonzero(self.delta_alive())
+
+        base_matrix = sparse.csr_matrix(self.base.matrix)[base_alive]
+        base_matrix = sparse.hstack(
+            [base_matrix, sparse.csr_matrix((len(base_alive), len(self.new_columns)),
+                                            dtype=np.uint8)],
+            format="csr",
+        )
+        matrix = sparse.vstack([base_matrix, self.delta.matrix[delta_alive]], format="csr")
+        names = ([self.base.recipe_names[row] for row in base_alive]
+                 + [self.delta_titles[pos] for pos in delta_alive])
+        recipe_ids = np.concatenate([self.base.recipe_ids[base_alive],
+                                     np.array(self.delta_ids, dtype=np.int64)[delta_alive]])
+        engine = ScoringEngine(names, self.ingredients, matrix, self.weights, backend,
+                               recipe_ids)
+
+        base_rows = np.full(self.num_base, -1)
+        base_rows[base_alive] = np.arange(len(base_alive))
+        delta_rows = np.full(len(self.delta_titles), -1)
+        delta_rows[delta_alive] = len(base_alive) + np.arange(len(delta_alive))
+        return engine, base_rows, delta_rows
+
+
+class RecommenderIndex:
+    """
+    A recipe catalog loaded for recommendation.
+    Nothing is read at construction: the matrix is loaded by an explicit
+    load(path) call, or lazily on first use from the configured path. Each
+    instance owns its own data, so several catalogs can live in one process.
+
+    Recipes can be upserted or deleted and ingredient columns added without
+    a rebuild: changes go to an append-only delta segment plus tombstones,
+    are searchable immediately, and are folded into the base matrix by
+    merge(), which runs in a background thread once enough updates pile up.
+    """
+
+    def __init__(self, path=None, ingredient_weights=None, backend="sparse",
+                 cache_size=1024, cache_ttl=300.0, merge_threshold=MERGE_THRESHOLD,
+                 workers=None, lsh_num_perm=None, lsh_bands=None):
+        """
+        Args:
+            path: recipe x ingredient matrix CSV or compiled index file
+                  (defaults to the bundled dataset)
+            ingredient_weights: {ingredient: weight}, defaults to INGREDIENT_WEIGHTS
+            backend: "sparse" (CSR) or "dense" matrix storage
+            cache_size: entries kept in the recommendation cache, 0 disables it
+            cache_ttl: seconds a cached recommendation stays valid
+            merge_threshold: pending updates that start a background merge,
+                             None to only merge on explicit merge() calls
+            workers: processes that batch queries are sharded across (see
+                     sharded_scoring.py), None to score batches in-process
+            lsh_num_perm, lsh_bands: MinHash values and LSH bands of the
+                     "approx_jaccard" mode, None for the minhash_lsh.py
+                     defaults (tuned for RECALL_TARGET on the bundled catalog)
+        """
+        from query_cache import QueryCache
+
+        self.path = path or DEFAULT_MATRIX_PATH
+        self.ingredient_weights = ingredient_weights
+        self.backend = backend
+        self.merge_threshold = merge_threshold
+        self.workers = workers
+        self.lsh_num_perm = lsh_num_perm
+        self.lsh_bands = lsh_bands
+
+        self.cache = QueryCache(cache_size, cache_ttl)
+
+        self._state = None
+        self._inverted_index = None
+        self._lsh = None
+        self._filter_masks = None
+        self._sharded_scorer = None
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+
+    @classmethod
+    def from_engine(cls, engine, **options):
+        """
+        Builds an index serving an existing ScoringEngine (e.g. a synthetic
+        catalog); options are passed to the constructor.
+        """
+        index = cls(**options)
+        index._set_state(_IndexState(engine, 1))
+        return index
+
+    def load(self, path=None):
+        """
+        (Re)loads the catalog, from path if given, else from the configured path.
+        A compiled index (see compiled_index.py) is memory-mapped instead of parsed.
+        Pending updates are discarded.
+        """
+        from scoring_engine import ScoringEngine
+        from compiled_index import is_compiled_index, open_index
+
+        with self._lock:
+            if path is not None:
+                self.path = path
+
+            if is_compiled_index(self.path):
+                engine = open_index(self.path, self.ingredient_weights)
+            else:
+                engine = ScoringEngine.from_csv(self.path, self._weights(),
+                                                backend=self.backend)
+            self._set_state(_IndexState(engine, self.version + 1))
+        return self
+
+    def _weights(self):
+        if self.ingredient_weights is not None:
+            return self.ingredient_weights
+        from ingredient_weights import INGREDIENT_WEIGHTS
+        return INGREDIENT_WEIGHTS
+
+    def _set_state(self, state):
+        self._state = state
+        # Cache keys carry the version; clearing also frees the stale entries
+        self.cache.clear()
+
+    @property
+    def loaded(self):
+        return self._state is not None
+
+    @property
+    def version(self):
+        """
+        Incremented on every load and update, so derived data can detect
+        stale state. A merge keeps the version: results do not change.
+        """
+        return 0 if self._state is None else self._state.version
+
+    @property
+    def state(self):
+        """
+        The current catalog snapshot, loading it on first use.
+        """
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self.load()
+        return self._state
+
+    @property
+    def engine(self):
+        """
+        The ScoringEngine of the merged catalog (pending updates excluded).
+        """
+        return self.state.base
+
+    @property
+    def inverted_index(self):
+        """
+        The InvertedIndex of the merged catalog, built on first use.
+        """
+        return self._inverted_for(self.state.base)
+
+    def _inverted_for(self, base):
+        index = self._inverted_index
+        if index is None or index.engine is not base:
+            from inverted_index import InvertedIndex
+            index = InvertedIndex(base)
+            self._inverted_index = index
+        return index
+
+    def _lsh_for(self, base):
+        lsh = self._lsh
+        if lsh is None or lsh.engine is not base:
+            from minhash_lsh import DEFAULT_BANDS, DEFAULT_NUM_PERM, MinHashLSH
+            lsh = MinHashLSH(base, self.lsh_num_perm or DEFAULT_NUM_PERM,
+                             self.lsh_bands or DEFAULT_BANDS)
+            self._lsh = lsh
+        return lsh
+
+    def _masks_for(self, base):
+        masks = self._filter_masks
+        if masks is None or masks.engine is not base:
+            from recipe_filters import FilterMasks
+            masks = FilterMasks(base, inverted_index=self._inverted_for(base))
+            self._filter_masks = masks
+        return masks
+
+    def _allowed(self, state, recipe_filter):
+        """
+        (base_allowed, delta_allowed) boolean arrays of the recipes
+        recipe_filter allows, or (None, None) without a filter.
+        """
+        import numpy as np
+
+        if not recipe_filter:
+            return None, None
+        base_allowed = self._masks_for(state.base).allowed(recipe_filter)
+        delta_allowed = (state.delta_masks.allowed(recipe_filter) if state.delta_titles
+                         else np.zeros(0, dtype=bool))
+        return base_allowed, delta_allowed
+
+    def _batch_scorer_for(self, base):
+        """
+        The object batch queries of `base` are scored with: the engine itself,
+        or a ShardedScorer over it when workers are configured.
+        """
+        if self.workers is None:
+            return base
+        with self._lock:
+            scorer = self._sharded_scorer
+            if scorer is None or scorer.engine is not base:
+                from sharded_scoring import ShardedScorer
+                if scorer is not None:
+                    # Batches already submitted to the old shards still finish
+                    scorer.close(wait=False)
+                scorer = ShardedScorer(base, self.workers)
+                self._sharded_scorer = scorer
+        return scorer
+
+    def close(self):
+        """
+        Stops the sharded scoring workers, if any.
+        """
+        with self._lock:
+            if self._sharded_scorer is not None:
+                self._sharded_scorer.close()
+                self._sharded_scorer = None
+
+    @property
+    def recipe_names(self):
+        state = self.state
+        if not state.has_updates:
+            return state.base.recipe_names
+        return [state.title_at(position) for position in state.alive_positions()]
+
+    @property
+    def recipe_ids(self):
+        """
+        IDs of the live recipes, aligned with recipe_names.
+        """
+        import numpy as np
+
+        state = self.state
+        if not state.has_updates:
+            return state.base.recipe_ids
+        return np.array([state.id_at(position) for position in state.alive_positions()],
+                        dtype=np.int64)
+
+    def score_recipe(self, ingredients_available, recipe, confidences=None,
+                     weight_overrides=None):
+        """
+        Weighted score of one recipe, given by ID (an int) or title (the
+        first live recipe with that title).
+        """
+        state = self.state
+        location = state.locate(recipe)
+        if location is None:
+            raise KeyError(recipe)
+        segment, row = location
+        engine = state.base if segment == "base" else state.delta
+        return engine.score_row(ingredients_available, row, confidences, weight_overrides)
+
+    def recommend(self, ingredients_available, num_recipes, mode="weighted",
+                  max_missing=None, confidences=None, weight_overrides=None,
+                  with_ids=False, recipe_filter=None, diversity=None, explain=False):
+        """
+        Returns the num_recipes best recipes, best first; num_recipes=None
+        returns the full ranking in every mode.
+        In "weighted" mode results are (recipe_name, score) pairs; in
+        "coverage" mode (recipe_name, coverage, missing) triples, optionally
+        restricted to recipes lacking at most max_missing ingredients; in
+        "jaccard" mode (recipe_name, similarity) pairs. "approx_jaccard" mode
+        ranks the same way, but only the recipes of the merged catalog that
+        share an LSH bucket with the pantry (see minhash_lsh.py) and the
+        pending upserted recipes, so it may return fewer than num_recipes.
+        With with_ids, every result starts with the recipe ID, which tells
+        apart recipes sharing a title.
+        In "weighted" mode, confidences (one per ingredient) and
+        weight_overrides ({ingredient: weight}) reweight this request only,
+        see ScoringEngine.query_columns; scores are then floats.
+        recipe_filter (a recipe_filters.RecipeFilter) restricts the results to
+        the recipes it allows; it is compiled to recipe masks before scoring,
+        so only the allowed recipes are scored, unless they are most of the
+        catalog (see ScoringEngine.score_columns).
+        diversity (0 to 1) re-ranks the best DIVERSITY_CANDIDATES recipes by
+        maximal marginal relevance, so near-identical recipes do not crowd
+        the results; see diversity.py. It needs an integer num_recipes.
+        With explain, every result ends with its explanation, see explain().
+        Results are cached per (index version, canonical pantry, arguments).
+        Weighted non-negative counts go through the inverted index; other
+        slice bounds fall back to a full vectorized scan.
+        Stages and counters are recorded in metrics.METRICS when enabled.
+        """
+        if mode not in RANKING_MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of {RANKING_MODES}")
+
+        METRICS.inc("queries_total", mode=mode)
+        state = self.state
+        with METRICS.stage("normalize"):
+            key = self._cache_key(state, ingredients_available, num_recipes, mode, max_missing,
+                                  confidences, weight_overrides, recipe_filter, diversity)
+        with METRICS.stage("cache_lookup"):
+            cached = self.cache.get(key)
+        if cached is not None:
+            METRICS.inc("cache_hits_total")
+            if explain:
+                cached = self._explained(state, cached, ingredients_available, confidences,
+                                         weight_overrides)
+            return _strip_ids(cached, with_ids)
+        METRICS.inc("cache_misses_total")
+
+        candidates = num_recipes
+        if diversity is not None:
+            from diversity import DIVERSITY_CANDIDATES
+            if not isinstance(num_recipes, int) or num_recipes < 0:
+                raise ValueError("diversity needs a non-negative integer num_recipes")
+            if not 0 <= diversity <= 1:
+                raise ValueError(f"diversity must be between 0 and 1, got {diversity}")
+            candidates = max(num_recipes, DIVERSITY_CANDIDATES)
+
+        with METRICS.stage("filter"):
+            allowed = self._allowed(state, recipe_filter)
+
+        if mode == "coverage":
+            result = self._coverage_ranking(state, ingredients_available, candidates,
+                                            max_missing, allowed)
+        elif mode == "jaccard":
+            result = self._jaccard_ranking(state, ingredients_available, candidates, allowed)
+        elif mode == "approx_jaccard":
+            result = self._approx_jaccard_ranking(state, ingredients_available, candidates,
+                                                  allowed)
+        elif isinstance(candidates, int) and candidates >= 0:
+            result = self._top_k(state, ingredients_available, candidates, confidences,
+                                 weight_overrides, allowed)
+        else:
+            result = self._full_ranking(state, ingredients_available, candidates,
+                                        confidences, weight_overrides, allowed)
+
+        if diversity is not None:
+            with METRICS.stage("diversify"):
+                result = self._diversify(state, result, num_recipes, diversity)
+        self.cache.put(key, tuple(result))
+        if explain:
+            result = self._explained(state, result, ingredients_available, confidences,
+                                     weight_overrides)
+        return _strip_ids(result, with_ids)
+
+    def cached_recommendation(self, ingredients_available, num_recipes):
+        """
+        Looks up the cached result of a plain weighted recommend() with
+        with_ids. Returns (key, result), result None on a miss; batched
+        callers fill the cache under key from their recommend_batch() result.
+        """
+        key = self._cache_key(self.state, ingredients_available, num_recipes)
+        cached = self.cache.get(key)
+        if cached is None:
+            METRICS.inc("cache_misses_total")
+            return key, None
+        METRICS.inc("cache_hits_total")
+        return key, list(cached)
+
+    @staticmethod
+    def _cache_key(state, ingredients_available, num_recipes, mode="weighted",
+                   max_missing=None, confidences=None, weight_overrides=None,
+                   recipe_filter=None, diversity=None):
+        # Validated before the cache lookup, so a bad request cannot hit the
+        # entry of a valid one
+        if weight_overrides is not None and not isinstance(weight_overrides, dict):
+            raise ValueError("weight_overrides must be a dict {ingredient: weight}")
+        overrides_key = tuple(sorted(weight_overrides.items())) if weight_overrides else None
+        return (state.version, state.canonical_query(ingredients_available, confidences),
+                num_recipes, mode, max_missing, overrides_key,
+                recipe_filter.key if recipe_filter else None, diversity)
+
+    def explain(self, ingredients_available, recipe_ids, confidences=None,
+                weight_overrides=None):
+        """
+        Explains the match of each recipe (by ID) with the pantry, as a dict
+        {"matched": [...], "missing": [...], "contributions": {...}}:
+        the recipe's ingredient IDs (columns of ingredients) found in the
+        pantry and lacking from it, and the weighted score each
+        INGREDIENT_WEIGHTS category contributes (categories that contribute
+        nothing are left out; they add up to the weighted score).
+        All recipes are explained in one vectorized pass over their rows.
+        """
+        state = self.state
+        return _explanations(state, state.id_positions(recipe_ids), ingredients_available,
+                             confidences, weight_overrides)
+
+    @staticmethod
+    def _explained(state, result, ingredients_available, confidences, weight_overrides):
+        with METRICS.stage("explain"):
+            positions = state.id_positions([item[0] for item in result])
+            explanations = _explanations(state, positions, ingredients_available,
+                                         confidences, weight_overrides)
+            return [item + (explanation,) for item, explanation in zip(result, explanations)]
+
+    def _top_k(self, state, ingredients_available, k, confidences=None,
+               weight_overrides=None, allowed=(None, None)):
+        import numpy as np
+        from scoring_engine import top_k_rows
+
+        base_allowed, delta_allowed = allowed
+        with METRICS.stage("score"):
+            base_rows, base_scores = self._inverted_for(state.base).top_k(
+                ingredients_available, k + len(state.base_deleted), confidences,
+                weight_overrides, base_allowed
+            )
+            delta_scores = None
+            if state.delta_titles:
+                delta_scores = state.delta.score(ingredients_available, confidences,
+                                                 weight_overrides)
+                METRICS.inc("candidates_scored_total", len(delta_scores), path="scan")
+        with METRICS.stage("rank"):
+            delta_rows = None
+            if delta_scores is not None:
+                candidates = (np.arange(len(delta_scores)) if delta_allowed is None
+                              else np.flatnonzero(delta_allowed))
+                delta_rows = candidates[top_k_rows(delta_scores[None, candidates],
+                                                   k + len(state.delta_deleted))[0]]
+                delta_scores = delta_scores[delta_rows]
+            positions, scores = self._merge_top_k(state, k, base_rows, base_scores,
+                                                  delta_rows, delta_scores)
+        with METRICS.stage("format"):
+            return _scored_titles(state, positions, scores)
+
+    @staticmethod
+    def _diversify(state, result, k, diversity):
+        """
+        The k results picked by MMR among result, whose third field (score,
+        coverage or similarity) is the relevance.
+        """
+        from diversity import mmr_order
+
+        if not result:
+            return result
+        positions = state.id_positions([item[0] for item in result])
+        picks = mmr_order([item[2] for item in result], state.ingredient_block(positions),
+                          state.weight_array(), k, diversity)
+        return [result[pick] for pick in picks]
+
+    @staticmethod
+    def _merge_top_k(state, k, base_rows, base_scores, delta_rows=None, delta_scores=None):
+        """
+        Merges best-first base and delta candidates into the positions and
+        scores of the k best live recipes. Candidate lists must hold k live
+        entries or all live ones.
+        """
+        import numpy as np
+
+        if state.base_deleted:
+            alive = state.base_alive()[base_rows]
+            base_rows, base_scores = base_rows[alive], base_scores[alive]
+        if delta_rows is None or not len(delta_rows):
+            # Base rows are their own positions
+            return base_rows[:k], base_scores[:k]
+
+        if state.delta_deleted:
+            alive = state.delta_alive()[delta_rows]
+            delta_rows, delta_scores = delta_rows[alive], delta_scores[alive]
+
+        # Delta rows rank after base rows on ties, as they will after a merge
+        positions = np.concatenate([base_rows, delta_rows + state.num_base])
+        scores = np.concatenate([base_scores, delta_scores])
+        order = np.lexsort((positions, -scores))[:k]
+        return positions[order], scores[order]
+
+    def _full_ranking(self, state, ingredients_available, num_recipes, confidences=None,
+                      weight_overrides=None, allowed=(None, None)):
+        import numpy as np
+
+        with METRICS.stage("score"):
+            scores = state.base.score(ingredients_available, confidences, weight_overrides)
+            if not state.has_updates and allowed[0] is None:
+                positions = np.arange(len(scores))
+            else:
+                positions = state.alive_positions(*allowed)
+                delta_scores = (state.delta.score(ingredients_available, confidences,
+                                                  weight_overrides)
+                                if state.delta_titles else np.empty(0, dtype=scores.dtype))
+                scores = np.concatenate([scores, delta_scores])[positions]
+            METRICS.inc("candidates_scored_total", len(scores), path="scan")
+
+        with METRICS.stage("rank"):
+            order = np.argsort(-scores, kind="stable")[:num_recipes]
+        with METRICS.stage("format"):
+            return _scored_titles(state, positions[order], scores[order])
+
+    def _coverage_ranking(self, state, ingredients_available, num_recipes, max_missing,
+                          allowed=(None, None)):
+        from scoring_engine import top_coverage_rows
+
+        with METRICS.stage("score"):
+            positions = state.alive_positions(*allowed)
+            _, missing, coverage = state.at_positions(
+                positions, lambda engine, rows: engine.coverage(ingredients_available, rows)
+            )
+            METRICS.inc("candidates_scored_total", len(coverage), path="scan")
+
+        with METRICS.stage("rank"):
+            if max_missing is not None:
+                keep = missing <= max_missing
+                positions, missing, coverage = positions[keep], missing[keep], coverage[keep]
+            # Positions are increasing, so index order is position order
+            order = top_coverage_rows(coverage, missing, num_recipes)
+        with METRICS.stage("format"):
+            return [(state.id_at(p), state.title_at(p), float(coverage[i]), int(missing[i]))
+                    for p, i in zip(positions[order], order)]
+
+    def _jaccard_ranking(self, state, ingredients_available, num_recipes,
+                         allowed=(None, None), positions=None, path="scan"):
+        import numpy as np
+
+        with METRICS.stage("score"):
+            if positions is None:
+                positions = state.alive_positions(*allowed)
+            # The base engine lacks the added columns, so the pantry size is
+            # taken over all of them, as it will be after a merge
+            pantry_size = state.pantry_size(ingredients_available)
+            similarity = state.at_positions(
+                positions,
+                lambda engine, rows: engine.jaccard(ingredients_available, rows, pantry_size)
+            )
+            METRICS.inc("candidates_scored_total", len(similarity), path=path)
+
+        with METRICS.stage("rank"):
+            order = np.argsort(-similarity, kind="stable")[:num_recipes]
+        with METRICS.stage("format"):
+            return [(state.id_at(p), state.title_at(p), float(similarity[i]))
+                    for p, i in zip(positions[order], order)]
+
+    def _approx_jaccard_ranking(self, state, ingredients_available, num_recipes,
+                                allowed=(None, None)):
+        import numpy as np
+
+        base_allowed, delta_allowed = allowed
+        with METRICS.stage("candidates"):
+            rows = self._lsh_for(state.base).candidates(ingredients_available)
+            if state.base_deleted:
+                rows = rows[np.isin(rows, list(state.base_deleted), invert=True)]
+            if base_allowed is not None:
+                rows = rows[base_allowed[rows]]
+            # Pending upserts are few and not in the LSH tables: all are ranked
+            delta_alive = state.delta_alive()
+            if delta_allowed is not None:
+                delta_alive &= delta_allowed
+            positions = np.concatenate([rows, np.flatnonzero(delta_alive) + state.num_base])
+        return self._jaccard_ranking(state, ingredients_available, num_recipes,
+                                     positions=positions, path="lsh")
+
+    def recommend_batch(self, ingredient_lists, num_recipes, chunk_size=None,
+                        with_ids=False):
+        """
+        Returns one recommend() result per ingredient list, scoring each chunk
+        of queries with one matrix-matrix product per segment. The base
+        segment is sharded across processes when workers are configured.
+        """
+        state = self.state
+        scorer = self._batch_scorer_for(state.base)
+
+        # None ranks every recipe, as in recommend()
+        k = (state.num_base + len(state.delta_titles) if num_recipes is None
+             else max(int(num_recipes), 0))
+        base = _per_query(scorer.top_k_batch(
+            ingredient_lists, k + len(state.base_deleted), chunk_size))
+        if state.delta_titles:
+            delta = _per_query(state.delta.top_k_batch(
+                ingredient_lists, k + len(state.delta_deleted), chunk_size))
+        else:
+            delta = ((None, None) for _ in ingredient_lists)
+
+        return [_strip_ids(_scored_titles(state, *self._merge_top_k(
+                    state, k, base_rows, base_scores, delta_rows, delta_scores)), with_ids)
+                for (base_rows, base_scores), (delta_rows, delta_scores) in zip(base, delta)]
+
+    def upsert_recipe(self, title, ingredients):
+        """
+        Adds a recipe, or replaces the live recipes with the same title.
+        The recipe is searchable as soon as this returns. Returns its new ID.
+        """
+        with self._lock:
+            state = self.state
+            unknown = [ingr for ingr in ingredients if not state.has_ingredient(ingr)]
+            if unknown:
+                raise ValueError(
+                    f"Unknown ingredients {unknown}, add them with add_ingredient() first"
+                )
+            state = state.without(title)
+            recipe_id = state.next_id
+            self._set_state(state.replace(
+                version=state.version + 1,
+                delta_titles=state.delta_titles + (title,),
+                delta_ingredients=state.delta_ingredients + (tuple(ingredients),),
+                delta_ids=state.delta_ids + (recipe_id,),
+                next_id=recipe_id + 1,
+            ))
+        self._maybe_merge()
+        return recipe_id
+
+    def delete_recipe(self, recipe):
+        """
+        Removes the live recipe with this ID (an int), or every live recipe
+        with this title (a str).
+        """
+        with self._lock:
+            state = self.state
+            if state.locate(recipe) is None:
+                raise KeyError(recipe)
+            state = state.without(recipe)
+            self._set_state(state.replace(version=state.version + 1))
+        self._maybe_merge()
+
+    def add_ingredient(self, ingredient, weight=None):
+        """
+        Adds an ingredient column; existing recipes do not contain it.
+        weight defaults to the configured ingredient weights.
+        """
+        from scoring_engine import DEFAULT_WEIGHT
+
+        with self._lock:
+            state = self.state
+            if state.has_ingredient(ingredient):
+                raise ValueError(f"Ingredient '{ingredient}' already exists")
+            if weight is None:
+                weight = self._weights().get(ingredient, DEFAULT_WEIGHT)
+            self._set_state(state.replace(
+                version=state.version + 1,
+                new_columns=state.new_columns + ((ingredient, weight),),
+            ))
+
+    def merge(self):
+        """
+        Folds the delta segment, tombstones and added columns into a new base
+        matrix. Queries and updates keep running against the previous state
+        while the new base is built; updates made meanwhile are carried over.
+        """
+        with self._merge_lock:
+            snapshot = self.state
+            if not snapshot.has_updates:
+                return
+            base, base_rows, delta_rows = snapshot.compact(self.backend)
+
+            with self._lock:
+                current = self._state
+                if current.base is not snapshot.base:
+                    # Reloaded in the meantime
+                    return
+
+                merged = len(snapshot.delta_titles)
+                base_deleted = {int(base_rows[row])
+                                for row in current.base_deleted - snapshot.base_deleted}
+                base_deleted |= {int(delta_rows[pos])
+                                 for pos in current.delta_deleted - snapshot.delta_deleted
+                                 if pos < merged}
+                delta_deleted = {pos - merged for pos in current.delta_deleted if pos >= merged}
+
+                # Same version: a merge does not change any result
+                self._state = _IndexState(
+                    base,
+                    current.version,
+                    base_deleted=frozenset(base_deleted),
+                    delta_titles=current.delta_titles[merged:],
+                    delta_ingredients=current.delta_ingredients[merged:],
+                    delta_deleted=frozenset(delta_deleted),
+                    new_columns=current.new_columns[len(snapshot.new_columns):],
+                    delta_ids=current.delta_ids[merged:],
+                    next_id=current.next_id,
+                )
+
+    def _maybe_merge(self):
+        if self.merge_threshold is None:
+            return
+        if self._state.pending_updates < self.merge_threshold:
+            return
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return
+            self._merge_thread = threading.Thread(target=self.merge, daemon=True)
+            self._merge_thread.start()
+
+
+def _scored_titles(state, positions, scores):
+    # (id, title, score) triples; int scores stay int, per-request weighting
+    # gives floats
+    return [(state.id_at(position), state.title_at(position), score.item())
+            for position, score in zip(positions, scores)]
+
+
+def _explanations(state, positions, ingredients_available, confidences=None,
+                  weight_overrides=None):
+    # Matched / missing ingredient IDs and per-category contributions of the
+    # recipes at positions, from masks over their ingredient rows
+    import numpy as np
+
+    query, listed = state.query_vector(ingredients_available, confidences, weight_overrides)
+    categories, codes = state.column_categories
+
+    present = state.ingredient_block(positions) > 0
+    matched = present & listed
+    missing = present & ~listed
+    contributions = (matched * query) @ np.eye(len(categories), dtype=query.dtype)[codes]
+
+    rows, matched_cols = np.nonzero(matched)
+    matched_cols = np.split(matched_cols, np.searchsorted(rows, np.arange(1, len(positions))))
+    rows, missing_cols = np.nonzero(missing)
+    missing_cols = np.split(missing_cols, np.searchsorted(rows, np.arange(1, len(positions))))
+
+    return [{
+        "matched": matched_cols[i].tolist(),
+        "missing": missing_cols[i].tolist(),
+        "contributions": {categories[c]: contributions[i, c].item()
+                          for c in np.flatnonzero(contributions[i])},
+    } for i in range(len(positions))]
+
+
+def _strip_ids(results, with_ids):
+    # Results are built and cached with the recipe ID first
+    if with_ids:
+        return list(results)
+    return [result[1:] for result in results]
+
+
+def _per_query(chunks):
+    # Flattens top_k_batch chunks into one (rows, scores) pair per query
+    for top, top_scores in chunks:
+        yield from zip(top, top_scores)
+
+
+# Process-wide shared index, created (not loaded) on first access
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the process-wide shared RecommenderIndex.
+    """
+    global _shared_index
+
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = RecommenderIndex()
+    return _shared_index
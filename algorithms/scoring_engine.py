@@ -0,0 +1,496 @@
+import numpy as np
+from scipy import sparse
+
+from string_table import StringTable
+
+# Weight given to ingredients that have no entry in INGREDIENT_WEIGHTS
+DEFAULT_WEIGHT = 2
+
+BACKENDS = ("dense", "sparse")
+
+# Upper bound on the query x recipe score block materialized per batch chunk
+BATCH_CHUNK_BYTES = 64 * 2**20
+
+# Row subsets smaller than 1 / ROW_SUBSET_RATIO of the matrix are sliced out
+# and scored alone; larger ones are read back from a score of every row
+ROW_SUBSET_RATIO = 2
+
+# Rows densified at a time when bit-packing a sparse matrix
+PACK_CHUNK_ROWS = 65536
+
+# Number of set bits of every byte value, for vectorized popcounts
+POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+class ScoringEngine:
+    """
+    Vectorized recipe scorer.
+    Holds the recipe x ingredient matrix either as a contiguous NumPy array
+    ("dense") or as a CSR matrix ("sparse"), and the ingredient weights as a
+    vector aligned to its columns, so every recipe is scored with a single
+    matrix-vector product.
+
+    Every row has an integer recipe ID (recipe_ids, increasing with the row,
+    0..n-1 by default) and a title in an interned StringTable. Titles need
+    not be unique: recipes that share a title stay distinct rows and IDs.
+    """
+
+    def __init__(self, recipe_names, ingredients, matrix, ingredient_weights,
+                 backend="dense", recipe_ids=None, postings=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+        self.backend = backend
+        # Titles are stored once as one UTF-8 blob (possibly memory-mapped)
+        # and only decoded when a result needs them
+        if not isinstance(recipe_names, StringTable):
+            recipe_names = StringTable.from_strings(recipe_names)
+        self.recipe_names = recipe_names
+        if recipe_ids is None:
+            recipe_ids = np.arange(len(recipe_names), dtype=np.int64)
+        self.recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        self.ingredients = list(ingredients)
+        self.column_index = {ingr: col for col, ingr in enumerate(self.ingredients)}
+        self._recipe_index = None
+        self._duplicate_rows = None
+        self._packed = None
+        self._recipe_sizes = None
+        self._postings = postings
+
+        if backend == "sparse":
+            self.matrix = sparse.csr_matrix(matrix, dtype=np.uint8)
+        elif sparse.issparse(matrix):
+            self.matrix = np.ascontiguousarray(matrix.toarray(), dtype=np.uint8)
+        else:
+            self.matrix = np.ascontiguousarray(matrix, dtype=np.uint8)
+
+        self.weights = np.array(
+            [ingredient_weights.get(ingr, DEFAULT_WEIGHT) for ingr in self.ingredients],
+            dtype=np.int64,
+        )
+
+    @classmethod
+    def from_dataframe(cls, matrix_df, ingredient_weights, backend="dense"):
+        """
+        Builds an engine from a recipe x ingredient DataFrame.
+        Rows sharing a title are kept as distinct recipes.
+        """
+        # Only cells equal to 1 count as "recipe uses ingredient"
+        return cls(matrix_df.index, matrix_df.columns, matrix_df.to_numpy() == 1,
+                   ingredient_weights, backend)
+
+    @classmethod
+    def from_csv(cls, path, ingredient_weights, backend="sparse", chunksize=100_000):
+        """
+        Builds an engine from a recipe x ingredient CSV.
+        The file is read chunksize rows at a time and each chunk is converted
+        to CSR before the next one is read, so the dense matrix never has to
+        fit in memory. Rows sharing a title are kept as distinct recipes.
+        """
+        import pandas as pd
+
+        recipe_names = []
+        blocks = []
+        ingredients = None
+
+        for chunk in pd.read_csv(path, index_col=0, chunksize=chunksize):
+            ingredients = chunk.columns
+            recipe_names.extend(chunk.index)
+            blocks.append(sparse.csr_matrix(chunk.to_numpy() == 1, dtype=np.uint8))
+
+        matrix = sparse.vstack(blocks, format="csr", dtype=np.uint8)
+        return cls(recipe_names, ingredients, matrix, ingredient_weights, backend)
+
+    @classmethod
+    def from_ingredient_lists(cls, recipe_names, ingredient_lists, ingredients,
+                              ingredient_weights, backend="sparse", recipe_ids=None):
+        """
+        Builds an engine from one ingredient list per recipe, over the given
+        ingredient columns. Ingredients outside the columns are ignored.
+        """
+        column_index = {ingr: col for col, ingr in enumerate(ingredients)}
+        rows, cols = [], []
+        for row, recipe_ingredients in enumerate(ingredient_lists):
+            for ingr in set(recipe_ingredients):
+                col = column_index.get(ingr)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.uint8), (rows, cols)),
+            shape=(len(ingredient_lists), len(ingredients)),
+        )
+        return cls(recipe_names, ingredients, matrix, ingredient_weights, backend,
+                   recipe_ids)
+
+    @property
+    def recipe_index(self):
+        """
+        {recipe_name: first row with that title}, built on first title lookup.
+        """
+        if self._recipe_index is None:
+            index, duplicates = {}, {}
+            for row, name in enumerate(self.recipe_names):
+                if name in index:
+                    duplicates.setdefault(name, [index[name]]).append(row)
+                else:
+                    index[name] = row
+            self._duplicate_rows = duplicates
+            self._recipe_index = index
+        return self._recipe_index
+
+    def title_rows(self, title):
+        """
+        All rows titled `title`, in row order.
+        """
+        row = self.recipe_index.get(title)
+        if row is None:
+            return []
+        return self._duplicate_rows.get(title, [row])
+
+    def id_rows(self, recipe_ids):
+        """
+        Rows of the given recipe IDs (-1 for unknown IDs), by binary search
+        over the increasing recipe_ids.
+        """
+        recipe_ids = np.asarray(recipe_ids, dtype=np.int64)
+        if not len(self.recipe_ids):
+            return np.full(recipe_ids.shape, -1, dtype=np.intp)
+        rows = np.minimum(np.searchsorted(self.recipe_ids, recipe_ids),
+                          len(self.recipe_ids) - 1)
+        return np.where(self.recipe_ids[rows] == recipe_ids, rows, -1)
+
+    @property
+    def packed(self):
+        """
+        Recipes as bit-packed ingredient sets (numpy.packbits over the
+        columns, one row per recipe), built on first use.
+        """
+        if self._packed is None:
+            blocks = []
+            for start in range(0, self.matrix.shape[0], PACK_CHUNK_ROWS):
+                block = self.matrix[start:start + PACK_CHUNK_ROWS]
+                if self.backend == "sparse":
+                    block = block.toarray()
+                blocks.append(np.packbits(block.astype(bool), axis=1))
+            num_bytes = (len(self.ingredients) + 7) // 8
+            self._packed = (np.vstack(blocks) if blocks
+                            else np.zeros((0, num_bytes), dtype=np.uint8))
+        return self._packed
+
+    @property
+    def postings(self):
+        """
+        The matrix in CSC order as (indptr, indices): the sorted rows of the
+        recipes containing each ingredient column. Built on first use, unless
+        given to the constructor (e.g. memory-mapped from a compiled index).
+        """
+        if self._postings is None:
+            postings = sparse.csc_matrix(self.matrix)
+            postings.sort_indices()
+            self._postings = (postings.indptr, postings.indices.astype(np.int32, copy=False))
+        return self._postings
+
+    @property
+    def recipe_sizes(self):
+        """
+        Number of ingredients of every recipe: the stored entries of each CSR
+        row, or the non-zeros of each dense row. Does not build the packed sets.
+        """
+        if self._recipe_sizes is None:
+            if self.backend == "sparse":
+                self._recipe_sizes = np.diff(self.matrix.indptr).astype(np.int64)
+            else:
+                self._recipe_sizes = np.count_nonzero(self.matrix, axis=1).astype(np.int64)
+        return self._recipe_sizes
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the matrix storage, in bytes.
+        """
+        if self.backend == "sparse":
+            return (self.matrix.data.nbytes + self.matrix.indices.nbytes
+                    + self.matrix.indptr.nbytes)
+        return self.matrix.nbytes
+
+    def query_columns(self, ingredients_available, confidences=None, weight_overrides=None):
+        """
+        Maps a list of ingredients to (column indices, query weights).
+        Unknown ingredients are dropped; an ingredient listed twice counts twice.
+
+        Per-request weighting: confidences (one per listed ingredient, e.g.
+        detection confidences) multiply the ingredient weights, and
+        weight_overrides ({ingredient: weight}) replace them. Query weights
+        are then floats; without either they stay integers.
+        """
+        if confidences is None and not weight_overrides:
+            cols = [self.column_index[ingr] for ingr in ingredients_available
+                    if ingr in self.column_index]
+            cols, counts = np.unique(np.array(cols, dtype=np.intp), return_counts=True)
+            return cols, self.weights[cols] * counts
+
+        if confidences is None:
+            confidences = np.ones(len(ingredients_available))
+        confidences = np.asarray(confidences, dtype=np.float64)
+        if len(confidences) != len(ingredients_available):
+            raise ValueError(f"Got {len(confidences)} confidences for "
+                             f"{len(ingredients_available)} ingredients")
+        weight_overrides = weight_overrides or {}
+        if (confidences < 0).any() or any(weight < 0 for weight in weight_overrides.values()):
+            raise ValueError("Confidences and weight overrides must be non-negative")
+
+        known = [pos for pos, ingr in enumerate(ingredients_available)
+                 if ingr in self.column_index]
+        ingredients = [ingredients_available[pos] for pos in known]
+        cols = np.array([self.column_index[ingr] for ingr in ingredients], dtype=np.intp)
+        weights = self.weights[cols].astype(np.float64)
+        for i, ingr in enumerate(ingredients):
+            if ingr in weight_overrides:
+                weights[i] = weight_overrides[ingr]
+
+        # Repeated ingredients add up, as in the unweighted case
+        cols, inverse = np.unique(cols, return_inverse=True)
+        return cols, np.bincount(inverse, weights=weights * confidences[known],
+                                 minlength=len(cols))
+
+    def score(self, ingredients_available, confidences=None, weight_overrides=None):
+        """
+        Returns the weighted score of every recipe, aligned with recipe_names.
+        See query_columns for confidences and weight_overrides.
+        """
+        return self.score_columns(*self.query_columns(ingredients_available, confidences,
+                                                      weight_overrides))
+
+    def score_columns(self, cols, query_weights, rows=None):
+        """
+        Returns the score of every recipe (or of the given rows) for the
+        query weights of columns cols, as given by query_columns.
+        Only the given rows are scored, unless they are most of the matrix,
+        where slicing them out would cost more than scoring every row.
+        """
+        subset = rows is not None and len(rows) * ROW_SUBSET_RATIO < self.matrix.shape[0]
+        if self.backend == "sparse":
+            # Sparse matrix-vector product: cost is proportional to the
+            # number of non-zeros, not recipes x ingredients
+            query = np.zeros(len(self.ingredients), dtype=query_weights.dtype)
+            query[cols] = query_weights
+            scores = (self.matrix[rows] if subset else self.matrix) @ query
+        elif subset:
+            scores = self.matrix[np.ix_(rows, cols)] @ query_weights
+        else:
+            scores = self.matrix[:, cols] @ query_weights
+        return scores if rows is None or subset else scores[rows]
+
+    def pack_query(self, ingredients_available):
+        """
+        The pantry as a bit-packed ingredient set aligned with `packed`.
+        """
+        pantry = np.zeros(len(self.ingredients), dtype=bool)
+        pantry[self.query_columns(ingredients_available)[0]] = True
+        return np.packbits(pantry)
+
+    def coverage(self, ingredients_available, rows=None):
+        """
+        Returns (matched, missing, coverage) arrays aligned with recipe_names
+        (or with the given rows): the recipe ingredients found in the pantry,
+        those lacking, and the matched fraction (0 for recipes without
+        ingredients).
+        Matched counts are one matrix-vector product with the pantry
+        indicator over the given rows, so the sparse backend only touches
+        their non-zeros.
+        """
+        cols = self.query_columns(ingredients_available)[0]
+        matched = self.score_columns(cols, np.ones(len(cols), dtype=np.int64), rows)
+        sizes = self.recipe_sizes if rows is None else self.recipe_sizes[rows]
+
+        coverage = np.divide(matched, sizes, out=np.zeros(len(sizes)), where=sizes > 0)
+        return matched, sizes - matched, coverage
+
+    def recommend_by_coverage(self, ingredients_available, num_recipes, max_missing=None):
+        """
+        Returns the num_recipes best (recipe_name, coverage, missing) triples,
+        ranked by coverage, then fewest missing ingredients, then row order.
+        With max_missing, only recipes lacking at most that many ingredients
+        are ranked.
+        """
+        _, missing, coverage = self.coverage(ingredients_available)
+        rows = np.arange(len(coverage))
+        if max_missing is not None:
+            rows = np.flatnonzero(missing <= max_missing)
+        order = rows[top_coverage_rows(coverage[rows], missing[rows], num_recipes)]
+        return [(self.recipe_names[row], float(coverage[row]), int(missing[row]))
+                for row in order]
+
+    def jaccard(self, ingredients_available, rows=None, pantry_size=None):
+        """
+        Jaccard similarity between the pantry and the ingredient set of every
+        recipe (or of the given rows), computed from the packed sets.
+        pantry_size overrides the number of distinct known pantry ingredients,
+        for pantries with ingredients outside this engine's columns.
+        """
+        packed, sizes = self.packed, self.recipe_sizes
+        if rows is not None:
+            packed, sizes = packed[rows], sizes[rows]
+
+        pantry = self.pack_query(ingredients_available)
+        if pantry_size is None:
+            pantry_size = int(POPCOUNT[pantry].sum())
+        matched = POPCOUNT[packed & pantry].sum(axis=1, dtype=np.int64)
+        union = sizes + pantry_size - matched
+        return np.divide(matched, union, out=np.zeros(len(union)), where=union > 0)
+
+    def recommend_by_jaccard(self, ingredients_available, num_recipes):
+        """
+        Returns the num_recipes best (recipe_name, jaccard) pairs, best first,
+        by exact Jaccard similarity. Ties keep the matrix row order.
+        """
+        similarity = self.jaccard(ingredients_available)
+        order = np.argsort(-similarity, kind="stable")[:num_recipes]
+        return [(self.recipe_names[row], float(similarity[row])) for row in order]
+
+    def query_matrix(self, ingredient_lists):
+        """
+        Builds the query x ingredient weight matrix (CSR) of a batch of
+        ingredient lists; row i holds the query weights of ingredient_lists[i].
+        """
+        rows, cols = [], []
+        for row, ingredients_available in enumerate(ingredient_lists):
+            for ingr in ingredients_available:
+                col = self.column_index.get(ingr)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+
+        cols = np.array(cols, dtype=np.intp)
+        # Duplicate (row, col) entries are summed, so a repeated ingredient counts twice
+        return sparse.csr_matrix(
+            (self.weights[cols], (np.array(rows, dtype=np.intp), cols)),
+            shape=(len(ingredient_lists), len(self.ingredients)),
+        )
+
+    def score_batch(self, queries):
+        """
+        Scores a query x ingredient weight matrix against every recipe with a
+        single matrix-matrix product. Returns a dense queries x recipes array.
+        """
+        if self.backend == "sparse":
+            # Sparse x dense: one pass over the matrix for all the queries,
+            # where sparse x sparse would build a sparse product first
+            return np.ascontiguousarray((self.matrix @ queries.T.toarray()).T)
+        return queries @ self.matrix.T
+
+    def score_recipe(self, ingredients_available, recipe, confidences=None,
+                     weight_overrides=None):
+        """
+        Returns the weighted score of a single recipe, looked up by title.
+        """
+        return self.score_row(ingredients_available, self.recipe_index[recipe],
+                              confidences, weight_overrides)
+
+    def score_row(self, ingredients_available, row, confidences=None,
+                  weight_overrides=None):
+        """
+        Returns the weighted score of the recipe at matrix row `row`.
+        """
+        cols, query_weights = self.query_columns(ingredients_available, confidences,
+                                                 weight_overrides)
+
+        if self.backend == "sparse":
+            values = self.matrix[row].toarray()[0]
+        else:
+            values = self.matrix[row]
+        # int for integer weights, float for per-request weighting
+        return (values[cols] @ query_weights).item()
+
+    def recommend(self, ingredients_available, num_recipes, confidences=None,
+                  weight_overrides=None):
+        """
+        Returns the num_recipes best (recipe_name, score) pairs, best first.
+        Ties keep the matrix row order.
+        """
+        scores = self.score(ingredients_available, confidences, weight_overrides)
+        order = np.argsort(-scores, kind="stable")[:num_recipes]
+        return [(self.recipe_names[row], scores[row].item()) for row in order]
+
+    def top_k_batch(self, ingredient_lists, k, chunk_size=None):
+        """
+        Yields (rows, scores) for consecutive chunks of ingredient_lists: the
+        k best recipe rows of each query, best first, and their scores.
+        Queries are scored chunk_size at a time; by default the chunk is sized
+        so that its score block stays under BATCH_CHUNK_BYTES.
+        """
+        if chunk_size is None:
+            chunk_size = max(1, BATCH_CHUNK_BYTES // (8 * max(len(self.recipe_names), 1)))
+
+        queries = self.query_matrix(ingredient_lists)
+        for start in range(0, queries.shape[0], chunk_size):
+            scores = self.score_batch(queries[start:start + chunk_size])
+            top = top_k_rows(scores, k)
+            yield top, np.take_along_axis(scores, top, axis=1)
+
+    def recommend_batch(self, ingredient_lists, num_recipes, chunk_size=None):
+        """
+        Returns one recommend() result per ingredient list.
+        """
+        results = []
+        for top, top_scores in self.top_k_batch(ingredient_lists, num_recipes, chunk_size):
+            for rows, row_scores in zip(top, top_scores):
+                results.append([(self.recipe_names[row], int(score))
+                                for row, score in zip(rows, row_scores)])
+        return results
+
+
+def top_k_rows(scores, k):
+    """
+    Column indices of the k largest entries of every row of a 2-D score
+    array, best first, with ties in column order.
+    Only the entries of a row that can make its top k are sorted: those at
+    least the smallest of k block maxima, a lower bound of the k-th largest.
+    Unlike argpartition, this does not degrade on the many tied scores of a
+    query. k=None ranks every column.
+    """
+    num_rows, num_cols = scores.shape
+    k = num_cols if k is None else min(max(int(k), 0), num_cols)
+    if k == 0:
+        return np.empty((num_rows, 0), dtype=np.intp)
+    if k == num_cols:
+        return np.argsort(-scores, axis=1, kind="stable")
+
+    bounds = scores[:, :num_cols // k * k].reshape(num_rows, k, -1).max(axis=2).min(axis=1)
+    top = np.empty((num_rows, k), dtype=np.intp)
+    for row, bound in enumerate(bounds):
+        candidates = np.flatnonzero(scores[row] >= bound)
+        # Candidates are in column order, which the stable sort keeps for ties
+        order = np.argsort(-scores[row, candidates], kind="stable")[:k]
+        top[row] = candidates[order]
+    return top
+
+
+def top_coverage_rows(coverage, missing, k):
+    """
+    Indices of the k best entries by coverage, then fewest missing, then
+    index. Only the rows that can make the top k are lexsorted: the best
+    rows with a matched ingredient and, when these are fewer than k, the
+    unmatched rows with the fewest missing ingredients. k=None ranks them all.
+    """
+    num_rows = len(coverage)
+    k = num_rows if k is None else min(max(int(k), 0), num_rows)
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+    candidates = np.flatnonzero(coverage)
+    if len(candidates) > k:
+        kth = np.partition(coverage[candidates], len(candidates) - k)[len(candidates) - k]
+        candidates = candidates[coverage[candidates] >= kth]
+    elif len(candidates) < k:
+        # Unmatched rows all have coverage 0 and tie on (missing, index),
+        # a unique integer key
+        unmatched = np.flatnonzero(coverage == 0)
+        needed = k - len(candidates)
+        key = missing[unmatched].astype(np.int64) * num_rows + unmatched
+        if needed < len(unmatched):
+            unmatched = unmatched[np.argpartition(key, needed - 1)[:needed]]
+        candidates = np.concatenate([candidates, unmatched])
+    order = np.lexsort((candidates, missing[candidates], -coverage[candidates]))[:k]
+    return candidates[order]
@@ -0,0 +1,200 @@
+"""
+Multi-process sharded scoring.
+
+The CSR arrays of a ScoringEngine are copied once into a shared memory
+block, and the recipe rows are split into contiguous shards holding about
+the same number of non-zeros. Pool workers map the block when they start,
+so a query only ships its (small) query matrix to the workers, never the
+catalog. Every shard computes the local top-k of its rows; the coordinator
+merges them by (score, row), which gives exactly the ranking of
+ScoringEngine.recommend since every global winner is a local winner of its
+shard.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from scipy import sparse
+
+from scoring_engine import BATCH_CHUNK_BYTES, top_k_rows
+
+# CSR arrays placed in the shared block, in order
+SHARED_ARRAYS = ("indptr", "indices", "data")
+
+# Set in every worker process by _attach
+_shared = None
+_shards = {}
+
+
+def _attach(name, layout, shape, bounds):
+    # Pool initializer: maps the shared CSR arrays once per worker
+    global _shared
+
+    memory = SharedMemory(name)
+    arrays = {key: np.ndarray(count, dtype=dtype, buffer=memory.buf, offset=offset)
+              for key, (dtype, offset, count) in layout.items()}
+    _shared = (memory, arrays, shape, bounds)
+
+
+def _shard_matrix(shard):
+    # CSR view of the rows of one shard; only indptr is rebased (copied)
+    matrix = _shards.get(shard)
+    if matrix is None:
+        _, arrays, shape, bounds = _shared
+        start, end = bounds[shard], bounds[shard + 1]
+        indptr = arrays["indptr"][start:end + 1]
+        lo, hi = indptr[0], indptr[-1]
+        matrix = sparse.csr_matrix(
+            (arrays["data"][lo:hi], arrays["indices"][lo:hi], indptr - lo),
+            shape=(end - start, shape[1]), copy=False,
+        )
+        _shards[shard] = matrix
+    return matrix
+
+
+def _shard_top_k(shard, queries, k):
+    """
+    Returns (rows, scores) of the k best rows of a shard for every query,
+    best first, with rows numbered in the whole catalog.
+    """
+    matrix = _shard_matrix(shard)
+    start = _shared[3][shard]
+    chunk_size = max(1, BATCH_CHUNK_BYTES // (8 * max(matrix.shape[0], 1)))
+
+    rows, scores = [], []
+    for first in range(0, queries.shape[0], chunk_size):
+        block = np.asarray((matrix @ queries[first:first + chunk_size].T).T.toarray())
+        top = top_k_rows(block, k)
+        rows.append(top + start)
+        scores.append(np.take_along_axis(block, top, axis=1))
+    return np.vstack(rows), np.vstack(scores)
+
+
+def shard_bounds(indptr, num_shards):
+    """
+    Row boundaries splitting a CSR matrix into num_shards contiguous shards
+    of about the same number of non-zeros. Shard i holds rows
+    bounds[i]:bounds[i + 1].
+    """
+    num_rows = len(indptr) - 1
+    targets = np.linspace(0, indptr[-1], num_shards + 1)[1:-1]
+    inner = np.searchsorted(indptr, targets)
+    bounds = np.concatenate([[0], np.clip(inner, 0, num_rows), [num_rows]])
+    return np.maximum.accumulate(bounds).astype(np.int64)
+
+
+class ShardedScorer:
+    """
+    Weighted top-k scoring of a ScoringEngine's recipes across a process
+    pool, with the matrix in shared memory. Has the top_k_batch /
+    recommend_batch / recommend interface of ScoringEngine, and returns the
+    same results. close() (or a with block) stops the pool and frees the
+    shared block.
+    """
+
+    def __init__(self, engine, workers=None, shards=None, mp_context="spawn"):
+        """
+        Args:
+            engine: ScoringEngine to shard; query columns and weights come from it
+            workers: worker processes, defaults to the number of CPUs
+            shards: row shards, defaults to one per worker
+            mp_context: multiprocessing start method of the workers
+        """
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        num_shards = shards or self.workers
+
+        matrix = sparse.csr_matrix(engine.matrix)
+        self.bounds = shard_bounds(matrix.indptr, num_shards)
+        self.num_shards = len(self.bounds) - 1
+
+        layout = {}
+        size = 0
+        for key in SHARED_ARRAYS:
+            array = getattr(matrix, key)
+            # 64-byte aligned sections, as in the compiled index format
+            size += -size % 64
+            layout[key] = (array.dtype.str, size, len(array))
+            size += array.nbytes
+
+        self._memory = SharedMemory(create=True, size=max(size, 1))
+        for key, (dtype, offset, count) in layout.items():
+            view = np.ndarray(count, dtype=dtype, buffer=self._memory.buf, offset=offset)
+            view[:] = getattr(matrix, key)
+            del view
+
+        self._pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=get_context(mp_context),
+            initializer=_attach,
+            initargs=(self._memory.name, layout, matrix.shape, self.bounds.tolist()),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self, wait=True):
+        """
+        Stops the pool and unlinks the shared block. With wait=False, queries
+        already submitted still finish: workers keep their mapping.
+        """
+        if self._pool is None:
+            return
+        self._pool.shutdown(wait=wait)
+        self._pool = None
+        self._memory.close()
+        self._memory.unlink()
+
+    def top_k(self, queries, k):
+        """
+        Returns (rows, scores): the k best recipe rows of every row of a
+        query x ingredient weight matrix (see ScoringEngine.query_matrix),
+        best first, ties in row order. k=None ranks every recipe.
+        """
+        if self._pool is None:
+            raise RuntimeError("ShardedScorer is closed")
+
+        k = len(self.engine.recipe_names) if k is None else max(int(k), 0)
+        futures = [self._pool.submit(_shard_top_k, shard, queries, k)
+                   for shard in range(self.num_shards)]
+        results = [future.result() for future in futures]
+        rows = np.hstack([rows for rows, _ in results])
+        scores = np.hstack([scores for _, scores in results])
+
+        order = np.lexsort((rows, -scores))[:, :k]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+    def top_k_batch(self, ingredient_lists, k, chunk_size=None):
+        """
+        Yields (rows, scores) for consecutive chunks of ingredient_lists,
+        like ScoringEngine.top_k_batch. By default the whole batch is sent
+        to the shards at once; workers bound their own score blocks.
+        """
+        queries = self.engine.query_matrix(ingredient_lists)
+        chunk_size = chunk_size or max(queries.shape[0], 1)
+        for start in range(0, queries.shape[0], chunk_size):
+            yield self.top_k(queries[start:start + chunk_size], k)
+
+    def recommend_batch(self, ingredient_lists, num_recipes, chunk_size=None):
+        """
+        Returns one recommend() result per ingredient list.
+        """
+        names = self.engine.recipe_names
+        results = []
+        for top, top_scores in self.top_k_batch(ingredient_lists, num_recipes, chunk_size):
+            for rows, row_scores in zip(top, top_scores):
+                results.append([(names[row], int(score))
+                                for row, score in zip(rows, row_scores)])
+        return results
+
+    def recommend(self, ingredients_available, num_recipes):
+        """
+        Returns the num_recipes best (recipe_name, score) pairs, best first.
+        """
+        return self.recommend_batch([ingredients_available], num_recipes)[0]
@@ -0,0 +1,157 @@
+"""
+Precomputed "similar recipes" neighbor table.
+
+An offline job computes, for every recipe, its top-N neighbors by weighted
+Jaccard similarity, each ingredient weighted by its INGREDIENT_WEIGHTS
+category weight:
+
+    wJ(a, b) = w(a & b) / (w(a) + w(b) - w(a & b))
+
+The intersections come from products matrix @ (rows x weights).T, computed
+for a chunk of recipes at a time; the chunk is sized from the number of
+recipes so that its dense similarity block stays under BATCH_CHUNK_BYTES,
+and only the top-N of each row is kept. Time grows with the square of the
+number of recipes, memory does not. The result
+is a compact table of neighbor recipe IDs and float16 scores, keyed by the
+stable recipe IDs of the catalog rather than its rows, so a "more like this"
+lookup at serve time is a single row read that survives reorders, upserts
+and deletes (recipes added since the table was built are rejected).
+
+Usage:
+    python similar_recipes.py [matrix.csv or compiled index] [output.npz] [top_n]
+"""
+
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+
+DEFAULT_TABLE_PATH = os.path.join(os.path.dirname(__file__), '..', 'datasets',
+                                  'similar_recipes.npz')
+
+# Empty neighbor slots (recipes with fewer than top_n overlapping recipes)
+NO_NEIGHBOR = -1
+
+
+def compute_neighbor_table(engine, top_n=10, chunk_rows=None):
+    """
+    Returns (ids, scores): int64 and float16 arrays of shape recipes x top_n
+    holding the recipe IDs of each recipe's nearest neighbors by weighted
+    Jaccard similarity, best first (ties by row). Unused slots hold
+    NO_NEIGHBOR and 0.
+    Recipes are processed chunk_rows at a time, by default as many as keep
+    the chunk x recipes similarity block under BATCH_CHUNK_BYTES.
+    """
+    from scoring_engine import BATCH_CHUNK_BYTES, top_k_rows
+
+    # float32 is exact for the small integer weight sums, and halves the block
+    matrix = sparse.csr_matrix(engine.matrix, dtype=np.float32)
+    weights = engine.weights.astype(np.float32)
+    recipe_weight = matrix @ weights
+
+    num_recipes = matrix.shape[0]
+    if chunk_rows is None:
+        chunk_rows = max(1, BATCH_CHUNK_BYTES // (4 * max(num_recipes, 1)))
+    ids = np.full((num_recipes, top_n), NO_NEIGHBOR, dtype=np.int64)
+    scores = np.zeros((num_recipes, top_n), dtype=np.float16)
+
+    for start in range(0, num_recipes, chunk_rows):
+        stop = min(start + chunk_rows, num_recipes)
+        # Weighted intersection of every chunk recipe with every recipe, as a
+        # dense block: with staple ingredients, most recipe pairs overlap
+        weighted = matrix[start:stop].toarray() * weights
+        shared = np.ascontiguousarray((matrix @ weighted.T).T)
+        # A recipe is not its own neighbor
+        shared[np.arange(stop - start), np.arange(start, stop)] = 0
+
+        # In place, as the block is large; recipes without ingredients have
+        # an empty union and share nothing, so they get 0 / tiny = 0
+        union = recipe_weight[start:stop, None] + recipe_weight
+        union -= shared
+        np.maximum(union, np.finfo(np.float32).tiny, out=union)
+        similarity = np.divide(shared, union, out=shared)
+
+        # Best first, ties by row; recipes sharing nothing are not neighbors
+        top = top_k_rows(similarity, top_n)
+        best = np.take_along_axis(similarity, top, axis=1)
+        found = best > 0
+        ids[start:stop, :top.shape[1]] = np.where(found, engine.recipe_ids[top], NO_NEIGHBOR)
+        scores[start:stop, :top.shape[1]] = np.where(found, best, 0)
+
+    return ids, scores
+
+
+class NeighborTable:
+    """
+    Neighbor recipe IDs and scores of every recipe, one row per recipe ID in
+    recipe_ids (increasing, as the engine's).
+    """
+
+    def __init__(self, recipe_ids, ids, scores):
+        self.recipe_ids = recipe_ids
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def build(cls, engine, top_n=10, chunk_rows=None):
+        return cls(engine.recipe_ids.copy(),
+                   *compute_neighbor_table(engine, top_n, chunk_rows))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as table:
+            if "recipe_ids" not in table:
+                raise ValueError(f"{path} is keyed by row, not by recipe ID: rebuild it")
+            return cls(table["recipe_ids"], table["ids"], table["scores"])
+
+    def save(self, path):
+        np.savez(path, recipe_ids=self.recipe_ids, ids=self.ids, scores=self.scores)
+
+    @property
+    def num_recipes(self):
+        return self.ids.shape[0]
+
+    def neighbors(self, recipe_id):
+        """
+        Returns (ids, scores) of the neighbors of recipe recipe_id, best first.
+        Raises KeyError if the recipe is not in the table.
+        """
+        row = np.searchsorted(self.recipe_ids, recipe_id)
+        if row == len(self.recipe_ids) or self.recipe_ids[row] != recipe_id:
+            raise KeyError(recipe_id)
+        ids = self.ids[row]
+        found = ids != NO_NEIGHBOR
+        return ids[found], self.scores[row][found].astype(np.float32)
+
+    def similar_recipes(self, engine, recipe, num_recipes=None):
+        """
+        Returns (recipe_name, score) pairs of the recipes most similar to
+        `recipe` (a title or a recipe ID) in `engine`. Neighbors deleted from
+        the engine since the table was built are skipped; a recipe added
+        since then raises ValueError, as the table must be rebuilt.
+        """
+        recipe_id = (int(engine.recipe_ids[engine.recipe_index[recipe]])
+                     if isinstance(recipe, str) else int(recipe))
+        try:
+            ids, scores = self.neighbors(recipe_id)
+        except KeyError:
+            raise ValueError(f"Recipe {recipe_id} is not in the neighbor table: "
+                             "rebuild it") from None
+
+        rows = engine.id_rows(ids)
+        live = rows >= 0
+        return [(engine.recipe_names[row], float(score))
+                for row, score in zip(rows[live][:num_recipes], scores[live][:num_recipes])]
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+    from recommender_index import RecommenderIndex
+
+    index = RecommenderIndex(sys.argv[1] if len(sys.argv) > 1 else None)
+    output_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_TABLE_PATH
+    top_n = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    NeighborTable.build(index.engine, top_n).save(output_path)
+    print(f"Neighbor table saved to {output_path}")
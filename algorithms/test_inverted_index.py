@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import inverted_index
+from inverted_index import InvertedIndex
+from scoring_engine import ScoringEngine
+
+
+def random_engine(num_recipes, num_ingredients, density, seed):
+    rng = np.random.default_rng(seed)
+    # Skewed popularity, so a few posting lists are long and most are short
+    popularity = 1.0 / np.arange(1, num_ingredients + 1)
+    matrix = rng.random((num_recipes, num_ingredients)) < density * popularity * 4
+    ingredients = [f"ingredient_{col}" for col in range(num_ingredients)]
+    # Few distinct weights, so many recipes tie
+    weights = {ingr: int(weight) for ingr, weight in
+               zip(ingredients, rng.integers(1, 4, size=num_ingredients))}
+    return ScoringEngine([f"recipe_{row}" for row in range(num_recipes)], ingredients,
+                         sparse.csr_matrix(matrix), weights, "sparse")
+
+
+def brute_force(engine, pantry, k, confidences=None, allowed=None):
+    # Full scan, best first, ties in row order, allowed rows only
+    scores = engine.score(pantry, confidences)
+    rows = np.arange(len(scores)) if allowed is None else np.flatnonzero(allowed)
+    rows = rows[np.argsort(-scores[rows], kind="stable")][:k]
+    return rows, scores[rows]
+
+
+@pytest.fixture(params=["postings", "binary_search", "dense_merge", "scan"])
+def path(request, monkeypatch):
+    if request.param != "scan":
+        monkeypatch.setattr(inverted_index, "SCAN_MAX_NNZ", 0)
+        monkeypatch.setattr(inverted_index, "SCAN_FRACTION", np.inf)
+        # Probe posting lists by binary search only, or never
+        monkeypatch.setattr(inverted_index, "PROBE_RATIO",
+                            0 if request.param == "binary_search" else np.inf)
+        # Merge posting lists by sorting only, or by bincount only
+        monkeypatch.setattr(inverted_index, "DENSE_MERGE_RATIO",
+                            np.inf if request.param == "dense_merge" else 0)
+    else:
+        monkeypatch.setattr(inverted_index, "SCAN_FRACTION", 0)
+    return request.param
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_top_k_matches_brute_force(path, seed):
+    engine = random_engine(400, 30, 0.05, seed)
+    index = InvertedIndex(engine)
+    rng = np.random.default_rng(seed)
+
+    for _ in range(40):
+        size = int(rng.integers(0, 8))
+        pantry = [f"ingredient_{col}" for col in rng.integers(0, 32, size=size)]
+        confidences = rng.choice([0.0, 0.5, 1.0], size=size) if rng.random() < 0.3 else None
+        allowed = rng.random(400) < 0.4 if rng.random() < 0.3 else None
+        # Includes k beyond the matching recipes (padding) and beyond the catalog
+        for k in (0, 1, 5, 50, 300, 500):
+            rows, scores = index.top_k(pantry, k, confidences, allowed=allowed)
+            expected_rows, expected_scores = brute_force(engine, pantry, k, confidences,
+                                                         allowed)
+            np.testing.assert_array_equal(rows, expected_rows)
+            np.testing.assert_array_equal(scores, expected_scores)
+
+
+def test_padding_keeps_row_order(path):
+    engine = random_engine(50, 10, 0.02, 0)
+    index = InvertedIndex(engine)
+    rows, scores = index.top_k(["ingredient_9"], 50)
+    matching = np.flatnonzero(scores > 0)
+    np.testing.assert_array_equal(rows[len(matching):],
+                                  np.setdiff1d(np.arange(50), rows[:len(matching)]))
@@ -0,0 +1,28 @@
+import numpy as np
+
+from minhash_lsh import RECALL_TARGET, MinHashLSH, recall_report
+from recommender_index import RecommenderIndex
+
+
+def perturbed_recipes(engine, num_queries, seed):
+    # Recipes' own ingredient sets, each ingredient kept with probability 0.8
+    rng = np.random.default_rng(seed)
+    queries = []
+    for row in rng.choice(len(engine.recipe_names), size=num_queries):
+        cols = engine.matrix[row].indices
+        keep = cols[rng.random(len(cols)) < 0.8]
+        queries.append([engine.ingredients[col] for col in keep])
+    return queries
+
+
+def test_default_settings_meet_recall_target():
+    engine = RecommenderIndex().engine
+    report = recall_report(MinHashLSH(engine), perturbed_recipes(engine, 200, 0))
+    assert report["recall"] >= RECALL_TARGET
+
+
+def test_index_passes_lsh_settings():
+    index = RecommenderIndex(lsh_num_perm=32, lsh_bands=8)
+    pantry = perturbed_recipes(index.engine, 1, 0)[0]
+    assert index.recommend(pantry, 5, mode="approx_jaccard")
+    assert (index._lsh.num_perm, index._lsh.bands) == (32, 8)
@@ -0,0 +1,27 @@
+import pytest
+
+from recommender_index import RANKING_MODES, RecommenderIndex
+from test_scoring_engine import random_engine
+
+
+@pytest.mark.parametrize("mode", RANKING_MODES)
+def test_num_recipes_none_returns_full_ranking(mode):
+    index = RecommenderIndex.from_engine(random_engine(200, 30, 0.1, 0, "sparse"))
+    index.upsert_recipe("upserted", ["ingredient_1", "ingredient_2"])
+    index.delete_recipe("recipe_3")
+    pantry = ["ingredient_1", "ingredient_2", "ingredient_5"]
+
+    full = index.recommend(pantry, None, mode)
+    everything = index.recommend(pantry, 1000, mode)
+    assert full == everything
+    if mode != "approx_jaccard":
+        # approx_jaccard ranks the LSH candidates only
+        assert len(full) == 200
+
+
+def test_recommend_batch_num_recipes_none():
+    index = RecommenderIndex.from_engine(random_engine(200, 30, 0.1, 0, "sparse"))
+    index.upsert_recipe("upserted", ["ingredient_1"])
+    pantries = [["ingredient_1"], ["ingredient_4", "ingredient_7"]]
+    assert (index.recommend_batch(pantries, None)
+            == [index.recommend(pantry, None) for pantry in pantries])
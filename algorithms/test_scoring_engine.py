@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from scoring_engine import ScoringEngine, top_k_rows
+
+
+def random_engine(num_recipes, num_ingredients, density, seed, backend):
+    rng = np.random.default_rng(seed)
+    matrix = rng.random((num_recipes, num_ingredients)) < density
+    ingredients = [f"ingredient_{col}" for col in range(num_ingredients)]
+    # Few distinct weights, so many recipes tie
+    weights = {ingr: int(weight) for ingr, weight in
+               zip(ingredients, rng.integers(1, 4, size=num_ingredients))}
+    return ScoringEngine([f"recipe_{row}" for row in range(num_recipes)], ingredients,
+                         sparse.csr_matrix(matrix), weights, backend)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_top_k_rows_matches_stable_sort(seed):
+    rng = np.random.default_rng(seed)
+    scores = rng.integers(0, 4, size=(6, 300))
+    scores[0] = 0
+    for k in (0, 1, 7, 100, 299, 300, 400):
+        expected = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        np.testing.assert_array_equal(top_k_rows(scores, k), expected)
+
+
+@pytest.mark.parametrize("backend", ["dense", "sparse"])
+def test_recommend_batch_matches_loop(backend):
+    engine = random_engine(500, 40, 0.1, 0, backend)
+    rng = np.random.default_rng(1)
+    pantries = [[f"ingredient_{col}" for col in rng.integers(0, 45, size=size)]
+                for size in rng.integers(0, 8, size=30)]
+    for k in (0, 5, 600):
+        # chunk_size=7 spreads the pantries over several score blocks
+        assert (engine.recommend_batch(pantries, k, chunk_size=7)
+                == [engine.recommend(pantry, k) for pantry in pantries])
+
+
+@pytest.mark.parametrize("backend", ["dense", "sparse"])
+def test_recipe_sizes_do_not_build_packed_sets(backend):
+    engine = random_engine(300, 40, 0.1, 2, backend)
+    sizes = engine.recipe_sizes
+    assert engine._packed is None
+    np.testing.assert_array_equal(sizes, np.unpackbits(engine.packed, axis=1).sum(axis=1))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from scoring_engine import ScoringEngine
+from similar_recipes import NeighborTable
+from test_scoring_engine import random_engine
+
+
+def test_table_survives_deletes_and_rejects_new_recipes(tmp_path):
+    engine = random_engine(200, 30, 0.15, 0, "sparse")
+    path = tmp_path / "table.npz"
+    NeighborTable.build(engine, top_n=5, chunk_rows=64).save(path)
+    table = NeighborTable.load(path)
+    before = table.similar_recipes(engine, "recipe_10")
+    assert len(before) == 5
+
+    # Delete the best neighbor and append a recipe: same row count, shifted rows
+    deleted = engine.recipe_index[before[0][0]]
+    keep = np.flatnonzero(np.arange(200) != deleted)
+    matrix = sparse.vstack([engine.matrix[keep], engine.matrix[:1]]).tocsr()
+    recipe_ids = np.append(engine.recipe_ids[keep], 200)
+    names = [engine.recipe_names[row] for row in keep] + ["recipe_200"]
+    updated = ScoringEngine(names, engine.ingredients, matrix,
+                            dict(zip(engine.ingredients, engine.weights.tolist())),
+                            "sparse", recipe_ids)
+
+    assert table.similar_recipes(updated, "recipe_10") == before[1:]
+    assert table.similar_recipes(updated, 10) == before[1:]
+    with pytest.raises(ValueError):
+        table.similar_recipes(updated, "recipe_200")
@@ -0,0 +1,73 @@
+"""
+Content-hash build cache of the matrix pipeline.
+
+map_recip_to_ing.py keys its per-row results by a hash of the row content
+(title and ingredient string). A rerun then only parses the rows whose hash
+is new: recipes added by the scraper are parsed, the rest is copied from
+the previous run. Hashes are computed for all rows at once with pandas'
+vectorized 64-bit hashing, and results are stored as arrays, so a rerun
+with nothing changed costs a fraction of a full parse.
+
+Entries live in a cache directory as a JSON metadata file plus, optionally,
+an .npz file of arrays.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = '.build_cache'
+
+
+def row_hashes(*columns):
+    """
+    64-bit content hash (uint64) of each row of the given aligned columns.
+    """
+    frame = pd.DataFrame({i: pd.Series(column, dtype=object).reset_index(drop=True)
+                          for i, column in enumerate(columns)})
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+class BuildCache:
+    """
+    Named cache entries in a directory: JSON metadata plus optional arrays.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, name, extension):
+        return os.path.join(self.directory, f"{name}.{extension}")
+
+    def load(self, name):
+        """
+        Returns (meta, arrays) of entry name, or (None, None) if it does not
+        exist or cannot be read. arrays is {} for an entry without arrays.
+        """
+        try:
+            with open(self._path(name, 'json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = {}
+            if os.path.exists(self._path(name, 'npz')):
+                with np.load(self._path(name, 'npz')) as data:
+                    arrays = {key: data[key] for key in data.files}
+        except (OSError, ValueError):
+            return None, None
+        return meta, arrays
+
+    def save(self, name, meta, **arrays):
+        """
+        Writes entry name. The metadata is written last, so an interrupted
+        save leaves no readable entry with mismatched arrays.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = self._path(name, 'json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        if arrays:
+            np.savez(self._path(name, 'npz'), **arrays)
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + '.tmp', meta_path)
@@ -2,8 +2,12 @@
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from data_process_pipelines.ingr_recip_matrx_pipeline.ing_map import ingredients
 
+DEFAULT_INPUT_PATH = "../datasets/recipe_ingredient_matrix_VF.csv"
+DEFAULT_OUTPUT_FILE = "recipe_ingredient_matrix_cleaned.csv"
+
 
 def create_reverse_mapping():
     """
@@ -30,26 +34,22 @@ def create_reverse_mapping():
     return reverse_mapping
 
 
-def clean_recipe_matrix():
+def consolidation_plan(columns, ingredient_mapping):
+    """
+    Groups the raw matrix columns by standardized name.
+    Returns (plan, removed_ingredients): plan maps each output column to its
+    raw columns, standardized names first, then unmapped_<raw> columns.
     """
-    Main function to clean and consolidate the recipe-ingredient matrix.
-    """    
-    df = pd.read_csv("../datasets/recipe_ingredient_matrix_VF.csv",index_col=0)
-
-    # Create reverse mapping from ingredients_format.py
-    ingredient_mapping = create_reverse_mapping()
-    
-    # Group columns by their standardized names
     consolidated_columns = {}
     removed_ingredients = []
     unmapped_ingredients = []
-    
-    for column in df.columns:
+
+    for column in columns:
         column_clean = column.strip().lower()
-        
+
         if column_clean in ingredient_mapping:
             category, standard_name = ingredient_mapping[column_clean]
-            
+
             if category == "remove":
                 removed_ingredients.append(column)
                 continue
@@ -62,34 +62,87 @@ def clean_recipe_matrix():
                 unmapped_ingredients.append(column)
         else:
             unmapped_ingredients.append(column)
-    
-    # Create the new consolidated dataframe
-    new_data = {}
-    
-    # Process consolidated columns (aggregate with OR logic for binary matrix)
-    for standard_name, raw_columns in consolidated_columns.items():
-        if len(raw_columns) == 1:
-            # Single column, just rename
-            new_data[standard_name] = df[raw_columns[0]]
-        else:
-            # Multiple columns, aggregate with OR (any 1 becomes 1)
-            aggregated = df[raw_columns].max(axis=1)
-            new_data[standard_name] = aggregated
-    
-    # Keep unmapped ingredients as-is 
+
+    # Keep unmapped ingredients as-is
+    plan = dict(consolidated_columns)
     for ingredient in unmapped_ingredients:
-        new_data[f"unmapped_{ingredient}"] = df[ingredient]
-    
-    # Create new dataframe
-    new_df = pd.DataFrame(new_data, index=df.index)
-    
+        plan[f"unmapped_{ingredient}"] = [ingredient]
+
+    return plan, removed_ingredients
+
+
+def projection_matrix(columns, plan):
+    """
+    Sparse raw column x output column matrix of a consolidation plan:
+    P[i, j] = 1 if raw column i goes into output column j.
+    """
+    column_index = {column: i for i, column in enumerate(columns)}
+    rows = [column_index[raw] for raw_columns in plan.values() for raw in raw_columns]
+    cols = np.repeat(np.arange(len(plan)), [len(raw_columns) for raw_columns in plan.values()])
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                             shape=(len(columns), len(plan)))
+
+
+def consolidate(df, plan):
+    """
+    Builds the consolidated dataframe of a consolidation plan.
+    A consolidated column is the OR of its raw columns, computed for all
+    columns at once as the sparse product raw matrix x projection_matrix,
+    thresholded back to binary.
+    A sparse frame (pandas SparseDtype columns, e.g. from
+    DataFrame.sparse.from_spmatrix over the build_matrix CSR) is processed
+    in time linear in its non-zeros and gives a sparse bool frame back. A
+    dense frame is scanned in full, O(recipes x ingredients), and gives a
+    dense 0/1 frame.
+    """
+    is_sparse = len(df.columns) > 0 and all(
+        isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes
+    )
+    if is_sparse:
+        raw = df.sparse.to_coo().tocsr()
+        raw.eliminate_zeros()
+        raw.data = np.ones(len(raw.data), dtype=np.int32)
+    else:
+        # Raw matrix as CSR, straight from the row-major positions of its non-zeros
+        num_rows, num_columns = df.shape
+        rows, cols = np.divmod(np.flatnonzero(df.to_numpy() != 0), num_columns)
+        indptr = np.zeros(num_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+        raw = sparse.csr_matrix((np.ones(len(cols), dtype=np.int32), cols, indptr),
+                                shape=(num_rows, num_columns))
+
+    counts = raw @ projection_matrix(df.columns, plan)
+    if is_sparse:
+        return pd.DataFrame.sparse.from_spmatrix(counts > 0, index=df.index,
+                                                 columns=list(plan))
+
+    counts = counts.tocoo()
+    consolidated = np.zeros(counts.shape, dtype=np.int64)
+    consolidated[counts.row, counts.col] = 1
+    return pd.DataFrame(consolidated, index=df.index, columns=list(plan), copy=False)
+
+
+def clean_recipe_matrix(input_path=DEFAULT_INPUT_PATH, output_file=DEFAULT_OUTPUT_FILE):
+    """
+    Main function to clean and consolidate the recipe-ingredient matrix.
+    """
+    df = pd.read_csv(input_path, index_col=0)
+
+    # Create reverse mapping from ingredients_format.py
+    ingredient_mapping = create_reverse_mapping()
+
+    # Group columns by their standardized names
+    plan, removed_ingredients = consolidation_plan(df.columns, ingredient_mapping)
+
+    # Create the new consolidated dataframe
+    new_df = consolidate(df, plan)
+
     # Remove duplicate rows (recipes with identical ingredient profiles)
     initial_recipes = len(new_df)
     new_df_deduplicated = new_df.drop_duplicates()
     final_recipes = len(new_df_deduplicated)
-    
+
     # Save the cleaned matrix
-    output_file = "recipe_ingredient_matrix_cleaned.csv"
     new_df_deduplicated.to_csv(output_file)
 
     return new_df_deduplicated
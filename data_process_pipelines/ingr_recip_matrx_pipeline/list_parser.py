@@ -0,0 +1,145 @@
+"""
+Fast parser for the ingredient list strings of the recipe CSVs.
+
+Rows hold either the Python repr of a list of strings
+(['ail', "huile d'olive"]), as first scraped, or its JSON form
+(["ail", "huile d'olive"]), as ingredients_scraper.py writes back.
+JSON rows, and repr rows without double quotes or escapes once requoted,
+are parsed by the C json decoder; other repr rows by one regular
+expression, unescaping only the rare items containing a backslash.
+ast.literal_eval is only used as a fallback for unusual but valid literals.
+
+parse_lists() parses many rows at once, in a process pool over chunks of
+rows, and reports malformed rows in aggregate (a count plus a few examples)
+instead of one message per row.
+"""
+
+import ast
+import json
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# Rows parsed per process pool task; smaller inputs are parsed in-process
+PARSE_CHUNK_ROWS = 50_000
+
+# Malformed rows kept as examples in a ParseReport
+MAX_EXAMPLES = 5
+
+# Quoted item bodies, as unrolled loops: runs of plain characters between escapes
+_SINGLE_BODY = r"[^'\\\n]*(?:\\.[^'\\\n]*)*"
+_DOUBLE_BODY = r'[^"\\\n]*(?:\\.[^"\\\n]*)*'
+_ITEM = rf"""(?:'{_SINGLE_BODY}'|"{_DOUBLE_BODY}")"""
+_ITEM_RE = re.compile(rf"""'({_SINGLE_BODY})'|"({_DOUBLE_BODY})\"""")
+_LIST_RE = re.compile(rf"\[\s*(?:{_ITEM}\s*,\s*)*(?:{_ITEM}\s*,?\s*)?\]")
+
+
+def parse_list(text):
+    """
+    Parses one ingredient list string into a list of str.
+    Raises ValueError if text is not a list of strings.
+    """
+    if not isinstance(text, str):
+        raise ValueError(f"expected a string, got {type(text).__name__}")
+    text = text.strip()
+
+    if '\\' not in text and '"' not in text:
+        # Without escapes or double quotes, a repr list is JSON once requoted
+        text_json = text.replace("'", '"')
+    else:
+        text_json = text
+    if text_json.startswith('["') or text_json == "[]":
+        try:
+            items = json.loads(text_json)
+        except ValueError:
+            items = None
+        if isinstance(items, list) and all(isinstance(item, str) for item in items):
+            return items
+
+    if _LIST_RE.fullmatch(text):
+        items = []
+        for single, double in _ITEM_RE.findall(text):
+            item = single or double
+            if "\\" in item:
+                # Python escapes (\', \\, \n, \xe9, ...)
+                item = ast.literal_eval(f"'{item}'" if single else f'"{item}"')
+            items.append(item)
+        return items
+
+    try:
+        items = ast.literal_eval(text)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+        raise ValueError(f"not a list literal ({type(e).__name__})") from None
+    if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+        raise ValueError("not a list of strings")
+    return items
+
+
+class ParseReport:
+    """
+    Aggregate of the malformed rows of a parse_lists call: their number and
+    the first few (row, text, error) examples.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.malformed = 0
+        self.examples = []
+
+    def add(self, row, text, error):
+        self.malformed += 1
+        if len(self.examples) < MAX_EXAMPLES:
+            self.examples.append((row, text if not isinstance(text, str) else text[:80],
+                                  str(error)))
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.malformed += other.malformed
+        self.examples.extend(other.examples[:MAX_EXAMPLES - len(self.examples)])
+
+    def summary(self):
+        if not self.malformed:
+            return f"Parsed {self.rows} rows"
+        examples = "; ".join(f"row {row}: {error} ({text!r})"
+                             for row, text, error in self.examples)
+        return f"Parsed {self.rows} rows, {self.malformed} malformed, e.g. {examples}"
+
+
+def _parse_chunk(start, texts):
+    # Parses texts[i] as row start + i; malformed rows give None
+    report = ParseReport()
+    report.rows = len(texts)
+    lists = []
+    for row, text in enumerate(texts, start):
+        try:
+            lists.append(parse_list(text))
+        except ValueError as e:
+            report.add(row, text, e)
+            lists.append(None)
+    return lists, report
+
+
+def parse_lists(texts, workers=None, chunk_rows=PARSE_CHUNK_ROWS, start=0, pool=None):
+    """
+    Parses a sequence of ingredient list strings.
+    Returns (lists, report): one list per row (None for malformed rows) and
+    a ParseReport, whose rows are numbered from start (the position of
+    texts[0] in the whole input). Chunks of chunk_rows rows are parsed in a
+    pool of workers processes (default: one per CPU) when there is more than
+    one chunk; pass pool (a ProcessPoolExecutor) to reuse one across calls.
+    """
+    texts = list(texts)
+    starts = range(0, len(texts), chunk_rows)
+    if len(starts) <= 1 or (workers == 1 and pool is None):
+        return _parse_chunk(start, texts)
+
+    if pool is None:
+        with ProcessPoolExecutor(workers) as pool:
+            return parse_lists(texts, chunk_rows=chunk_rows, start=start, pool=pool)
+
+    lists, report = [], ParseReport()
+    chunks = pool.map(_parse_chunk, [start + offset for offset in starts],
+                      [texts[offset:offset + chunk_rows] for offset in starts])
+    for chunk_lists, chunk_report in chunks:
+        lists.extend(chunk_lists)
+        report.merge(chunk_report)
+    return lists, report
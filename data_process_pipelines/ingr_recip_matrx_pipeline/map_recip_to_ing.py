@@ -1,56 +1,302 @@
 import pandas as pd
-import ast 
+import json
+import os
+import sys
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from scipy import sparse
+from data_process_pipelines.ingr_recip_matrx_pipeline.build_cache import BuildCache, row_hashes
+from data_process_pipelines.ingr_recip_matrx_pipeline.list_parser import parse_lists
 
-def recipe_ingredient_matrix(recipe_dataset_path):
+DEFAULT_OUTPUT_PATH = 'recipe_ingredient_matrix.csv'
+
+# Recipes read, parsed and written per segment in streaming mode
+STREAM_CHUNK_ROWS = 100_000
+MANIFEST_NAME = 'manifest.json'
+
+
+def build_matrix(ingredient_lists, ingredients=None, dtype=np.uint8):
     """
-    Returns a binary matrix of size 
+    Builds the sparse (CSR) binary matrix of size
     num_recipes x num_distinct_ingredients
-    where M[i,j] = 1 if recipe i has ingredient j 
+    where M[i,j] = 1 if recipe i has ingredient j.
+    Columns are the sorted distinct ingredients, or the given ingredients
+    (ingredients outside them are dropped).
+    Returns (matrix, ingredients).
+    """
+    if ingredients is None:
+        vocabulary = set()
+        for recipe_ingredients in ingredient_lists:
+            vocabulary.update(recipe_ingredients)
+        ingredients = sorted(vocabulary)
+
+    # Hash vocabulary: one dict lookup per cell instead of a list search
+    column_index = {ingredient: col for col, ingredient in enumerate(ingredients)}
+
+    # Coordinate arrays of every (recipe, ingredient) cell
+    lengths = np.fromiter((len(recipe_ingredients) for recipe_ingredients in ingredient_lists),
+                          dtype=np.int64, count=len(ingredient_lists))
+    rows = np.repeat(np.arange(len(ingredient_lists), dtype=np.int32), lengths)
+    cols = np.fromiter((column_index.get(ingredient, -1)
+                        for ingredient in chain.from_iterable(ingredient_lists)),
+                       dtype=np.int32, count=int(lengths.sum()))
+    known = cols >= 0
+    rows, cols = rows[known], cols[known]
+
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=dtype), (rows, cols)),
+                               shape=(len(ingredient_lists), len(ingredients)))
+    # An ingredient listed twice in a recipe is still a single 1
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix, list(ingredients)
+
+
+def parse_recipes(recipe_titles, raw_ingredient_lists, workers=None, start=0, pool=None):
+    """
+    Parses the ingredient list strings of a batch of recipes (in a process
+    pool for large batches, see list_parser.parse_lists).
+    Returns (recipe_names, ingredient_lists, failed_count); recipes whose
+    list cannot be read are skipped and reported together, numbered from
+    start, the row of the batch's first recipe in the input.
+    """
+    parsed, report = parse_lists(raw_ingredient_lists, workers, start=start, pool=pool)
+    if report.malformed:
+        print(f"Skipping malformed recipes: {report.summary()}")
+
+    recipe_names = []
+    ingredient_lists = []
+    for recipe_name, recipe_ingredients in zip(recipe_titles, parsed):
+        if recipe_ingredients is not None:
+            recipe_names.append(recipe_name)
+            ingredient_lists.append(recipe_ingredients)
+
+    return recipe_names, ingredient_lists, report.malformed
+
+
+def build_matrix_cached(recipe_titles, raw_ingredient_lists, cache_dir, workers=None):
+    """
+    parse_recipes + build_matrix with a build cache. Rows are keyed by a
+    hash of their title and ingredient string, and the cache keeps the
+    binary matrix rows of the previous run as a CSR over its ingredient
+    vocabulary, so only rows not seen by that run are parsed. Rows gone from
+    the input are dropped from the cache.
+    Returns (recipe_names, matrix, ingredients, failed_count), as
+    parse_recipes followed by build_matrix would.
+    """
+    cache = BuildCache(cache_dir)
+    meta, arrays = cache.load('map_rows')
+
+    recipe_titles = list(recipe_titles)
+    raw_ingredient_lists = pd.Series(raw_ingredient_lists, dtype=object).reset_index(drop=True)
+    keys = row_hashes(recipe_titles, raw_ingredient_lists)
+    if meta is not None:
+        vocabulary = meta['ingredients']
+        cached = sparse.csr_matrix(
+            (np.ones(len(arrays['indices']), dtype=np.uint8), arrays['indices'],
+             arrays['indptr']), shape=(len(arrays['keys']), len(vocabulary)))
+        old_rows = pd.Index(arrays['keys']).get_indexer(keys)
+        parsed_ok = np.zeros(len(keys), dtype=bool)
+        parsed_ok[old_rows >= 0] = arrays['parsed'][old_rows[old_rows >= 0]]
+    else:
+        vocabulary, cached = [], sparse.csr_matrix((0, 0), dtype=np.uint8)
+        old_rows = np.full(len(keys), -1)
+        parsed_ok = np.zeros(len(keys), dtype=bool)
+
+    todo = np.flatnonzero(old_rows < 0)
+    parsed, report = parse_lists(raw_ingredient_lists.to_numpy()[todo], workers)
+    # Reported as rows of the input, not of the rows left to parse
+    report.examples = [(int(todo[row]), text, error) for row, text, error in report.examples]
+    if report.malformed:
+        print(f"Skipping malformed recipes: {report.summary()}")
+    print(f"Parsed {len(todo)} new or changed recipes, reused {len(keys) - len(todo)}")
+
+    # New ingredients get the next columns, so cached rows stay valid
+    column_index = {ingredient: col for col, ingredient in enumerate(vocabulary)}
+    for ingredient in chain.from_iterable(lists for lists in parsed if lists is not None):
+        if ingredient not in column_index:
+            column_index[ingredient] = len(vocabulary)
+            vocabulary.append(ingredient)
+    parsed_ok[todo] = [lists is not None for lists in parsed]
+    new_matrix, _ = build_matrix([lists or [] for lists in parsed], vocabulary)
+
+    # Row i of the stacked matrix is cached row old_rows[i], or parsed row todo[j]
+    cached.resize((cached.shape[0], len(vocabulary)))
+    stacked = sparse.vstack([cached, new_matrix], format='csr')
+    source = old_rows.copy()
+    source[todo] = cached.shape[0] + np.arange(len(todo))
+    matrix = stacked[source]
+
+    # Identical rows share one key and one cache entry
+    unique_keys, first = np.unique(keys, return_index=True)
+    entries = matrix[first]
+    cache.save('map_rows', {'ingredients': vocabulary}, keys=unique_keys,
+               parsed=parsed_ok[first], indptr=entries.indptr, indices=entries.indices)
+
+    # As build_matrix over the parsed rows: used ingredients only, sorted
+    matrix = matrix[parsed_ok]
+    used = np.flatnonzero(np.bincount(matrix.indices, minlength=len(vocabulary)))
+    order = sorted(used, key=vocabulary.__getitem__)
+    recipe_names = [title for title, ok in zip(recipe_titles, parsed_ok) if ok]
+    return (recipe_names, matrix[:, order], [vocabulary[col] for col in order],
+            len(keys) - len(recipe_names))
+
+
+def recipe_ingredient_matrix(recipe_dataset_path, output_path=DEFAULT_OUTPUT_PATH,
+                             sparse_output=False, cache_dir=None):
+    """
+    Returns a binary matrix of size
+    num_recipes x num_distinct_ingredients
+    where M[i,j] = 1 if recipe i has ingredient j
+    as a DataFrame (uint8, or pandas sparse with sparse_output), saved as
+    CSV to output_path unless it is None.
+    With cache_dir, only recipes new or changed since the previous run with
+    that cache are parsed (see build_cache.py).
     """
     # Load recipe/ingredients dataset as pandas DataFrame
     df = pd.read_csv(recipe_dataset_path, delimiter=',')
-    
-    ingredients = set()  # Using set for unique values
-    recipes = []
-    failed_count = 0
-
-    for recipe_idx in range(len(df)):
-        recipe_ingredients = df.loc[recipe_idx]['ingredients']
-        recipe_name = df.loc[recipe_idx]['recipe_title']
-
-        try: 
-            recipe_ingredients = ast.literal_eval(recipe_ingredients)  # Convert str to list
-            recipes.append({'recipe_title': recipe_name, 'ingredients': recipe_ingredients})
-            ingredients.update(recipe_ingredients)
-        except Exception as e: 
-            print(f"Problem reading recipe '{recipe_name}', skipping: {e}")
-            failed_count += 1
-            continue 
-
-    print(f"Successfully processed {len(recipes)} recipes")
+
+    if cache_dir is not None:
+        recipe_names, matrix, ingredients, failed_count = build_matrix_cached(
+            df['recipe_title'], df['ingredients'], cache_dir)
+    else:
+        recipe_names, ingredient_lists, failed_count = parse_recipes(df['recipe_title'],
+                                                                     df['ingredients'])
+        matrix, ingredients = build_matrix(ingredient_lists)
+
+    print(f"Successfully processed {len(recipe_names)} recipes")
     print(f"Failed recipes: {failed_count}")
     print(f"Unique ingredients: {len(ingredients)}")
 
-    # Sort the list of ingredients 
-    ingredients = sorted(list(ingredients))
-    matrix = np.zeros((len(recipes), len(ingredients)), dtype=int)
-    recipe_names = []
+    if sparse_output:
+        matrix_df = pd.DataFrame.sparse.from_spmatrix(
+            matrix,
+            index=recipe_names,  # Rows = recipes
+            columns=ingredients  # Columns = ingredients
+        )
+    else:
+        matrix_df = pd.DataFrame(
+            matrix.toarray(),
+            index=recipe_names,  # Rows = recipes
+            columns=ingredients  # Columns = ingredients
+        )
+
+    if output_path is not None:
+        matrix_df.to_csv(output_path)
+        print(f"Matrix saved to {output_path}")
+
+    return matrix_df
+
+
+def stream_recipe_ingredient_matrix(recipe_dataset_path, output_dir,
+                                    chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Streaming version of recipe_ingredient_matrix for recipe dumps larger
+    than memory. The CSV is read chunk_rows recipes at a time; each chunk is
+    parsed, turned into a sparse segment and written to output_dir before
+    the next one is read, so peak memory depends on chunk_rows, not on the
+    size of the dump.
+    The ingredient vocabulary grows on the fly: a new ingredient gets the
+    next column, so earlier segments stay valid and just have fewer columns.
+    output_dir receives segment_<n>.npz files (CSR indptr / indices of the
+    binary matrix, and the recipe titles as UTF-8 blob + offsets) and a
+    manifest.json listing the ingredient columns and the segments.
+    Returns the manifest.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    ingredients = []
+    column_index = {}
+    segments = []
+    recipe_count = failed_total = 0
+
+    # One process pool for all chunks; malformed rows are reported by their
+    # row in the whole CSV
+    row_offset = 0
+    chunks = pd.read_csv(recipe_dataset_path, delimiter=',', chunksize=chunk_rows)
+    with ProcessPoolExecutor() as pool:
+        for segment, chunk in enumerate(chunks):
+            recipe_names, ingredient_lists, failed_count = parse_recipes(
+                chunk['recipe_title'], chunk['ingredients'], start=row_offset, pool=pool)
+            row_offset += len(chunk)
+            failed_total += failed_count
+
+            for ingredient in chain.from_iterable(ingredient_lists):
+                if ingredient not in column_index:
+                    column_index[ingredient] = len(ingredients)
+                    ingredients.append(ingredient)
+
+            matrix, _ = build_matrix(ingredient_lists, ingredients)
+            titles = [str(name).encode('utf-8') for name in recipe_names]
+            title_offsets = np.zeros(len(titles) + 1, dtype=np.int64)
+            np.cumsum([len(title) for title in titles], out=title_offsets[1:])
+
+            path = f"segment_{segment:05d}.npz"
+            np.savez(os.path.join(output_dir, path),
+                     indptr=matrix.indptr, indices=matrix.indices,
+                     title_blob=np.frombuffer(b"".join(titles), dtype=np.uint8),
+                     title_offsets=title_offsets)
+            segments.append({"path": path, "rows": len(recipe_names),
+                             "columns": len(ingredients)})
+            recipe_count += len(recipe_names)
+            print(f"Segment {segment}: {len(recipe_names)} recipes, "
+                  f"{len(ingredients)} ingredients so far")
+
+    manifest = {"ingredients": ingredients, "segments": segments,
+                "recipes": recipe_count, "failed": failed_total}
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    print(f"Successfully processed {recipe_count} recipes")
+    print(f"Failed recipes: {failed_total}")
+    print(f"Unique ingredients: {len(ingredients)}")
+    return manifest
+
+
+def iter_matrix_segments(output_dir):
+    """
+    Yields (recipe_names, matrix) per segment written by
+    stream_recipe_ingredient_matrix, each matrix a uint8 CSR over all the
+    manifest's ingredient columns.
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    num_columns = len(manifest["ingredients"])
+    for segment in manifest["segments"]:
+        with np.load(os.path.join(output_dir, segment["path"])) as data:
+            indices, indptr = data["indices"], data["indptr"]
+            blob, offsets = data["title_blob"].tobytes(), data["title_offsets"]
+        recipe_names = [blob[start:end].decode('utf-8')
+                        for start, end in zip(offsets[:-1], offsets[1:])]
+        matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.uint8), indices, indptr),
+                                   shape=(segment["rows"], num_columns))
+        yield recipe_names, matrix
+
+
+def load_matrix_segments(output_dir):
+    """
+    Assembles the segments written by stream_recipe_ingredient_matrix into
+    (matrix, recipe_names, ingredients), with the columns in sorted order
+    like recipe_ingredient_matrix.
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        ingredients = json.load(f)["ingredients"]
+
+    recipe_names, blocks = [], []
+    for names, matrix in iter_matrix_segments(output_dir):
+        recipe_names.extend(names)
+        blocks.append(matrix)
+    matrix = (sparse.vstack(blocks, format='csr') if blocks
+              else sparse.csr_matrix((0, len(ingredients)), dtype=np.uint8))
+
+    order = sorted(range(len(ingredients)), key=ingredients.__getitem__)
+    return matrix[:, order], recipe_names, [ingredients[col] for col in order]
+
 
-    for recipe_idx, recipe_data in enumerate(recipes):
-        recipe_names.append(recipe_data['recipe_title'])  # Fixed key name
-        for ingredient in recipe_data['ingredients']:
-            if ingredient in ingredients:
-                ingredient_idx = ingredients.index(ingredient)
-                matrix[recipe_idx][ingredient_idx] = 1
-
-    matrix_df = pd.DataFrame(
-        matrix, 
-        index=recipe_names,  # Rows = recipes
-        columns=ingredients  # Columns = ingredients
-    )
-
-    matrix_df.to_csv('/Users/antoinechosson/Desktop/TDLOG_project/recipe_ingredient_matrix.csv')
-    print("Matrix saved to recipe_ingredient_matrix.csv")
-    
-    return matrix_df
\ No newline at end of file
+if __name__ == "__main__":
+    # From the repository root:
+    # python -m data_process_pipelines.ingr_recip_matrx_pipeline.map_recip_to_ing \
+    #     recipes.csv output_dir [chunk_rows]
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) > 3 else STREAM_CHUNK_ROWS
+    stream_recipe_ingredient_matrix(sys.argv[1], sys.argv[2], chunk_rows)
@@ -8,10 +8,13 @@ from selenium.webdriver.common.keys import Keys
 import pandas as pd
 import time
 import os
-import ast
+import sys
 import csv
 import json
 
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from data_process_pipelines.ingr_recip_matrx_pipeline.list_parser import parse_lists
+
 ### Setting chrome driver hyperparameters for web scraping ###
 
 options = Options()
@@ -126,18 +129,15 @@ df = pd.read_csv(csv_filename, encoding="utf-8-sig")
 if 'ingredients' not in df.columns:
     df['ingredients'] = None
 
-# Convert ingredients column to real Python lists
-def safe_list(x):
-    if isinstance(x, list):
-        return x
-    if pd.isna(x) or x in ["", "None", "[]"]:
-        return []
-    try:
-        return ast.literal_eval(x)
-    except:
-        return []
-
-df['ingredients'] = df['ingredients'].apply(safe_list)
+# Convert ingredients column to real Python lists; empty and malformed
+# cells become [] (still to be scraped). Parsed in-process: pool workers
+# would re-run this script on platforms that spawn them.
+cells = df['ingredients']
+cells = cells.where(cells.notna() & ~cells.isin(["", "None"]), "[]")
+parsed, report = parse_lists(cells, workers=1)
+df['ingredients'] = [lst if lst is not None else [] for lst in parsed]
+if report.malformed:
+    print(f"Malformed ingredient lists reset to []: {report.summary()}")
 
 print(f"Loaded CSV with {len(df)} recipes")
 print("Columns:", df.columns.tolist())